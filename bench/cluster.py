@@ -0,0 +1,84 @@
+import contextlib, os, shutil, socket, subprocess, tempfile
+
+import psycopg2
+
+
+def find_binary(name, bindir=None):
+    if bindir:
+        return os.path.join(bindir, name)
+
+    path = shutil.which(name)
+    if path is None:
+        raise RuntimeError(f"{name} not found; pass --pg-bindir.")
+
+    return path
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def temporary_cluster(bindir=None, user="bench"):
+    """Run a private PostgreSQL cluster for the length of the block.
+
+    The cluster only listens on a Unix socket inside its data directory,
+    skips fsync and is deleted afterwards. Yields a ``DATABASE`` config
+    mapping whose default database (named after the user) exists.
+    """
+    data_dir = tempfile.mkdtemp(prefix="ditf-bench-")
+    port = get_free_port()
+    pg_ctl = find_binary("pg_ctl", bindir)
+
+    subprocess.run(
+        [
+            find_binary("initdb", bindir),
+            "--pgdata",
+            data_dir,
+            "--username",
+            user,
+            "--auth",
+            "trust",
+            "--encoding",
+            "UTF8",
+            "--no-sync",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    subprocess.run(
+        [
+            pg_ctl,
+            "--pgdata",
+            data_dir,
+            "--log",
+            os.path.join(data_dir, "server.log"),
+            "--wait",
+            "--options",
+            f"-p {port} -k {data_dir} -c listen_addresses='' "
+            "-c fsync=off -c synchronous_commit=off "
+            "-c full_page_writes=off",
+            "start",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+    try:
+        conn = psycopg2.connect(
+            host=data_dir, port=port, user=user, dbname="postgres"
+        )
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'CREATE DATABASE "{user}";')
+        conn.close()
+
+        yield {"HOST": data_dir, "PORT": port, "USER": user, "PASSWORD": ""}
+    finally:
+        subprocess.run(
+            [pg_ctl, "--pgdata", data_dir, "--mode", "fast", "stop"],
+            stdout=subprocess.DEVNULL,
+        )
+        shutil.rmtree(data_dir, ignore_errors=True)
@@ -0,0 +1,441 @@
+"""Benchmark every blueprint endpoint against a seeded database.
+
+    python -m bench.run                      # throwaway cluster, both modes
+    python -m bench.run --db-host localhost --db-user bench --reset-db
+    python -m bench.run --compare bench/results/<earlier run>.json
+
+Each scenario is run through the Flask test client (no network, one
+thread) and through a threaded WSGI server on localhost. Query counts come
+from the Server-Timing header, so instrumentation is always switched on.
+Requests that fail with a 5xx are left out of the timings, and any of
+them makes the run exit with an error once the results are written.
+"""
+import contextlib, json, math, os, platform, random, re, subprocess, sys
+import tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.client import HTTPConnection
+from urllib.parse import urlencode
+
+import click
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from ditf import create_app
+
+from .cluster import temporary_cluster
+from .seed import ADMIN_USERNAME, PASSWORD, seed
+
+DB_TIMING_RE = re.compile(r'(?:^|,\s*)db;dur=[\d.]+;desc="(\d+)"')
+
+# (name, method, make path, form data, logged in as admin)
+SCENARIOS = (
+    ("blog.index", "GET", lambda ids, rng: "/", None, False),
+    (
+        "blog.index tag",
+        "GET",
+        lambda ids, rng: f"/?tag_id={rng.choice(ids['tag_ids'])}",
+        None,
+        False,
+    ),
+    (
+        "blog.index search",
+        "GET",
+        lambda ids, rng: "/?" + urlencode({"q": rng.choice(ids["words"])}),
+        None,
+        False,
+    ),
+    (
+        "blog.detail",
+        "GET",
+        lambda ids, rng: f"/{rng.choice(ids['post_ids'])}",
+        None,
+        False,
+    ),
+    (
+        "blog.detail_file",
+        "GET",
+        lambda ids, rng: "/%d/%d" % rng.choice(ids["file_ids"]),
+        None,
+        False,
+    ),
+    (
+        "sitemap.show_sitemap",
+        "GET",
+        lambda ids, rng: "/sitemap.xml",
+        None,
+        False,
+    ),
+    ("auth.login GET", "GET", lambda ids, rng: "/auth/login", None, False),
+    (
+        "auth.login POST",
+        "POST",
+        lambda ids, rng: "/auth/login",
+        {"username": ADMIN_USERNAME, "password": PASSWORD},
+        False,
+    ),
+    ("admin.view_users", "GET", lambda ids, rng: "/admin/", None, True),
+    (
+        "admin.view_comments",
+        "GET",
+        lambda ids, rng: "/admin/comments",
+        None,
+        True,
+    ),
+)
+
+
+def make_config(database, concurrency, page_cache):
+    return {
+        "SECRET_KEY": "bench",
+        "DOMAIN": "http://localhost/",
+        "WTF_CSRF_ENABLED": False,
+        "DATABASE": dict(database, POOL_MAX_SIZE=concurrency + 2),
+        "INSTRUMENTATION": {
+            "ENABLED": True,
+            "SLOW_QUERY_MS": math.inf,
+            "SLOW_REQUEST_MS": math.inf,
+        },
+        "PAGE_CACHE": {"BACKEND": "memory" if page_cache else "none"},
+        "IMAGES": {"ENABLED": False},
+    }
+
+
+class ClientDriver:
+    def __init__(self, app):
+        self.client = app.test_client(use_cookies=False)
+
+    def request(self, method, path, data=None, cookie=None):
+        headers = {"Cookie": cookie} if cookie else {}
+        response = self.client.open(
+            path, method=method, data=data, headers=headers
+        )
+        response.close()
+
+        return response.status_code, response.headers
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerDriver:
+    def __init__(self, app):
+        self.server = make_server(
+            "127.0.0.1",
+            0,
+            app,
+            threaded=True,
+            request_handler=QuietRequestHandler,
+        )
+        self.port = self.server.server_port
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.thread.start()
+
+    def request(self, method, path, data=None, cookie=None):
+        headers = {"Cookie": cookie} if cookie else {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        conn = HTTPConnection("127.0.0.1", self.port)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status, response.headers
+        finally:
+            conn.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def log_in(driver):
+    _, headers = driver.request(
+        "POST",
+        "/auth/login",
+        {"username": ADMIN_USERNAME, "password": PASSWORD},
+    )
+    cookie = headers.get("Set-Cookie", str())
+
+    return cookie.split(";", 1)[0]
+
+
+def percentile(values, q):
+    index = max(0, math.ceil(q / 100 * len(values)) - 1)
+
+    return values[min(index, len(values) - 1)]
+
+
+def get_query_count(headers):
+    match = DB_TIMING_RE.search(headers.get("Server-Timing", str()))
+
+    return int(match.group(1)) if match else 0
+
+
+def run_scenario(driver, scenario, ids, cookie, requests, warmup, workers):
+    name, method, make_path, data, admin = scenario
+    rng = random.Random(name)
+    paths = [make_path(ids, rng) for _ in range(warmup + requests)]
+    cookie = cookie if admin else None
+
+    def send(path):
+        started = time.perf_counter()
+        status, headers = driver.request(method, path, data, cookie)
+        return time.perf_counter() - started, status, headers
+
+    for path in paths[:warmup]:
+        send(path)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(send, paths[warmup:]))
+    elapsed = time.perf_counter() - started
+
+    statuses = dict()
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    # Failed requests are counted but kept out of the numbers; a 500 that
+    # returns quickly would otherwise look like a speed-up.
+    succeeded = [result for result in results if result[1] < 500]
+    if not succeeded:
+        return {
+            "requests": len(results),
+            "statuses": statuses,
+            "errors": len(results),
+        }
+
+    latencies = sorted(latency * 1000 for latency, _, _ in succeeded)
+    queries = [get_query_count(headers) for _, _, headers in succeeded]
+
+    return {
+        "requests": len(results),
+        "statuses": statuses,
+        "errors": len(results) - len(succeeded),
+        "throughput": len(succeeded) / elapsed,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies),
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1],
+        },
+        "queries": {
+            "mean": sum(queries) / len(queries),
+            "max": max(queries),
+        },
+    }
+
+
+def get_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(mode, results, baseline=None):
+    click.echo(f"\n[{mode}]")
+    click.echo(
+        f"{'scenario':<24}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+        f"{'queries':>9}{'errors':>8}"
+    )
+    for name, result in results.items():
+        if "latency_ms" not in result:
+            click.echo(f"{name:<24}{'failed':>45}{result['errors']:>8}")
+            continue
+
+        latency = result["latency_ms"]
+        line = (
+            f"{name:<24}{result['throughput']:>9.1f}{latency['p50']:>9.2f}"
+            f"{latency['p95']:>9.2f}{latency['p99']:>9.2f}"
+            f"{result['queries']['mean']:>9.1f}{result['errors']:>8}"
+        )
+        previous = (baseline or {}).get(mode, {}).get(name)
+        if previous and "latency_ms" in previous:
+            change = latency["p50"] / previous["latency_ms"]["p50"] - 1
+            line += f"  p50 {change:+.1%}"
+        click.echo(line)
+
+
+@click.command()
+@click.option("--db-host", help="Use this server instead of a temp cluster.")
+@click.option("--db-port", default=5432, show_default=True)
+@click.option("--db-user", default="bench", show_default=True)
+@click.option("--db-password", default=str())
+@click.option("--pg-bindir", help="Directory with initdb and pg_ctl.")
+@click.option(
+    "--reset-db",
+    is_flag=True,
+    help="Allow dropping and reseeding the tables on --db-host.",
+)
+@click.option("--users", default=50, show_default=True)
+@click.option("--posts", default=2000, show_default=True)
+@click.option("--tags", default=20, show_default=True)
+@click.option("--comments", default=20000, show_default=True)
+@click.option("--files", default=200, show_default=True)
+@click.option("--file-size", default=64 * 1024, show_default=True)
+@click.option("--requests", default=200, show_default=True)
+@click.option("--warmup", default=20, show_default=True)
+@click.option("--concurrency", default=8, show_default=True)
+@click.option(
+    "--mode",
+    type=click.Choice(("client", "server", "both")),
+    default="both",
+    show_default=True,
+)
+@click.option("--page-cache/--no-page-cache", default=True)
+@click.option("--scenario", "only", multiple=True, help="Run only these.")
+@click.option("--output", type=click.Path(dir_okay=False))
+@click.option("--compare", type=click.File("r"), help="Earlier results.")
+def main(
+    db_host,
+    db_port,
+    db_user,
+    db_password,
+    pg_bindir,
+    reset_db,
+    users,
+    posts,
+    tags,
+    comments,
+    files,
+    file_size,
+    requests,
+    warmup,
+    concurrency,
+    mode,
+    page_cache,
+    only,
+    output,
+    compare,
+):
+    """Seed a database and benchmark the blog's endpoints."""
+    started = datetime.now(timezone.utc)
+    if db_host and not reset_db:
+        raise click.UsageError(
+            "Seeding drops every table; pass --reset-db to confirm."
+        )
+
+    volumes = {
+        "users": users,
+        "posts": posts,
+        "tags": tags,
+        "comments": comments,
+        "files": files,
+        "file_size": file_size,
+    }
+    scenarios = [
+        scenario for scenario in SCENARIOS if not only or scenario[0] in only
+    ]
+    modes = ("client", "server") if mode == "both" else (mode,)
+    baseline = json.load(compare)["results"] if compare else None
+
+    with contextlib.ExitStack() as stack:
+        if db_host:
+            database = {
+                "HOST": db_host,
+                "PORT": db_port,
+                "USER": db_user,
+                "PASSWORD": db_password,
+            }
+        else:
+            database = stack.enter_context(
+                temporary_cluster(pg_bindir, db_user)
+            )
+
+        instance_path = stack.enter_context(
+            tempfile.TemporaryDirectory(prefix="ditf-bench-instance-")
+        )
+        app = create_app(
+            make_config(database, concurrency, page_cache), instance_path
+        )
+
+        click.echo("Seeding...")
+        with app.app_context():
+            ids = seed(**volumes)
+
+        results = dict()
+        for mode_name in modes:
+            if mode_name == "client":
+                driver, workers = ClientDriver(app), 1
+            else:
+                driver, workers = ServerDriver(app), concurrency
+
+            try:
+                cookie = log_in(driver)
+                results[mode_name] = {
+                    scenario[0]: run_scenario(
+                        driver,
+                        scenario,
+                        ids,
+                        cookie,
+                        requests,
+                        warmup,
+                        workers,
+                    )
+                    for scenario in scenarios
+                }
+            finally:
+                driver.close()
+
+            print_results(mode_name, results[mode_name], baseline)
+
+        app.extensions["view_counter"].close()
+        app.extensions["db_pool"].close()
+
+    report = {
+        "meta": {
+            "started": started.isoformat(),
+            "revision": get_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "volumes": volumes,
+            "requests": requests,
+            "warmup": warmup,
+            "concurrency": concurrency,
+            "page_cache": page_cache,
+        },
+        "results": results,
+    }
+
+    if output is None:
+        output = os.path.join(
+            os.path.dirname(__file__),
+            "results",
+            f"{started.strftime('%Y%m%d-%H%M%S')}.json",
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_fh:
+        json.dump(report, output_fh, indent=2)
+    click.echo(f"\nWrote {output}.")
+
+    failed = [
+        f"{mode_name} {name}"
+        for mode_name, mode_results in results.items()
+        for name, result in mode_results.items()
+        if result["errors"]
+    ]
+    if failed:
+        raise click.ClickException(
+            "Server errors (5xx) in: " + ", ".join(failed) + "."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import hashlib, os, random
+from datetime import datetime, timedelta
+
+import psycopg2.extras
+from werkzeug.security import generate_password_hash
+
+from ditf.db import get_conn, get_cur, init_db
+from ditf.render import render_all
+from ditf.search import update_search_vector
+from ditf.uploads import get_blob_path
+
+ADMIN_USERNAME = "admin"
+PASSWORD = "bench_password"
+WORDS = (
+    "flask python postgres index query cache latency thread worker "
+    "markdown render template session cookie upload image sitemap "
+    "블로그 개발 성능 데이터 검색 서버 요청 응답 댓글 태그 파일 사진 "
+    "여행 일상 음악 영화 책 요리 커피 산책 주말 기록"
+).split()
+
+
+def make_text(rng, min_words, max_words):
+    return " ".join(
+        rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))
+    )
+
+
+def make_body(rng, paragraphs, attachment=None):
+    parts = [f"## {make_text(rng, 2, 5)}"]
+    for _ in range(paragraphs):
+        parts.append(make_text(rng, 40, 120))
+    if attachment is not None:
+        parts.append(f"![{attachment}]({attachment})")
+
+    return "\n\n".join(parts)
+
+
+def store_blob(data):
+    digest = hashlib.sha256(data).hexdigest()
+    blob_path = get_blob_path(digest)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    with open(blob_path, "wb") as blob_fh:
+        blob_fh.write(data)
+
+    return digest, blob_path
+
+
+def seed(
+    users=50,
+    posts=2000,
+    tags=20,
+    comments=20000,
+    files=200,
+    file_size=64 * 1024,
+    random_seed=0,
+):
+    """Replace the database contents with generated data.
+
+    Must run inside an app context. User 1 is the admin and every user's
+    password is ``PASSWORD``. Returns the ids the scenarios pick from.
+    """
+    rng = random.Random(random_seed)
+    init_db()
+    conn = get_conn()
+    cur = get_cur()
+    password = generate_password_hash(PASSWORD)
+
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO users (username, mail, password, about) VALUES %s;",
+        [
+            (
+                ADMIN_USERNAME if n == 1 else f"user{n}",
+                f"user{n}@example.com",
+                password,
+                make_text(rng, 5, 20),
+            )
+            for n in range(1, users + 1)
+        ],
+    )
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO tags (title) VALUES %s;",
+        [(f"tag{n}",) for n in range(1, tags + 1)],
+    )
+
+    now = datetime.now()
+    attached = set(rng.sample(range(1, posts + 1), min(files, posts)))
+    post_rows = list()
+    for post_id in range(1, posts + 1):
+        created = now - timedelta(minutes=(posts - post_id) * 30)
+        attachment = f"file-{post_id}.dat" if post_id in attached else None
+        post_rows.append(
+            (
+                1,
+                created,
+                created,
+                make_text(rng, 2, 8)[:100],
+                make_body(rng, rng.randint(1, 8), attachment),
+                rng.randint(0, 1000),
+            )
+        )
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO posts "
+        "(author_id, created, modified, title, body, views) VALUES %s;",
+        post_rows,
+        page_size=500,
+    )
+
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO post2tag (post_id, tag_id) VALUES %s "
+        "ON CONFLICT DO NOTHING;",
+        [
+            (post_id, tag_id)
+            for post_id in range(1, posts + 1)
+            for tag_id in rng.sample(range(1, tags + 1), rng.randint(0, 3))
+        ],
+        page_size=1000,
+    )
+
+    comment_rows = list()
+    for _ in range(comments):
+        post_id = rng.randint(1, posts)
+        created = post_rows[post_id - 1][1] + timedelta(
+            minutes=rng.randint(1, 600)
+        )
+        comment_rows.append(
+            (
+                rng.randint(1, users),
+                post_id,
+                created,
+                created,
+                make_text(rng, 3, 30),
+            )
+        )
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO comments "
+        "(author_id, post_id, created, modified, body) VALUES %s;",
+        comment_rows,
+        page_size=1000,
+    )
+
+    file_rows = list()
+    for post_id in sorted(attached):
+        data = rng.randbytes(file_size)
+        digest, blob_path = store_blob(data)
+        file_rows.append(
+            (post_id, f"file-{post_id}.dat", blob_path, digest, len(data))
+        )
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO files (post_id, file_name, file_path, blob_hash, size) "
+        "VALUES %s;",
+        file_rows,
+        page_size=1000,
+    )
+    conn.commit()
+
+    update_search_vector(cur)
+    conn.commit()
+    render_all()
+    cur.execute("ANALYZE;")
+    conn.commit()
+
+    cur.execute("SELECT id, post_id FROM files ORDER BY id;")
+    file_ids = [(row["post_id"], row["id"]) for row in cur.fetchall()]
+    conn.commit()
+
+    return {
+        "post_ids": list(range(1, posts + 1)),
+        "tag_ids": list(range(1, tags + 1)),
+        "file_ids": file_ids,
+        "words": list(WORDS),
+    }
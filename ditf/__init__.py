@@ -1,21 +1,49 @@
-from datetime import datetime, timezone
 from os.path import join as path_join
-from xml.etree.ElementTree import Element, ElementTree, SubElement, indent
 
 from flask import Flask, render_template, send_file
 from flask_wtf.csrf import CSRFError, CSRFProtect
-from . import admin, auth, blog, db
-
-
-def create_app():
-    app = Flask(__name__, instance_relative_config=True)
-    app.config.from_json("config.json")
-
+from . import (
+    admin,
+    auth,
+    blog,
+    cache,
+    conditional,
+    counter,
+    db,
+    images,
+    instrument,
+    profiler,
+    render,
+    search,
+    sitemap,
+    uploads,
+)
+
+
+def create_app(test_config=None, instance_path=None):
+    app = Flask(
+        __name__, instance_path=instance_path, instance_relative_config=True
+    )
+    if test_config is None:
+        app.config.from_json("config.json")
+    else:
+        app.config.from_mapping(test_config)
+
+    instrument.init_app(app)
+    profiler.init_app(app)
     db.init_app(app)
+    render.init_app(app)
+    search.init_app(app)
+    counter.init_app(app)
+    conditional.init_app(app)
+    cache.init_app(app)
+    uploads.init_app(app)
+    images.init_app(app)
 
     app.register_blueprint(admin.BP)
     app.register_blueprint(auth.BP)
     app.register_blueprint(blog.BP)
+    app.register_blueprint(sitemap.BP)
     app.add_url_rule("/", endpoint="index")
 
     csrf = CSRFProtect()
@@ -46,51 +74,17 @@ def create_app():
             error.code,
         )
 
-    @app.route("/sitemap.xml", methods=("GET",))
-    def show_sitemap():
-        cur = db.get_cur()
-        cur.execute("SELECT id, created, modified FROM posts ORDER BY created;")
-        posts = cur.fetchall()
-
-        xml_urlset = Element("urlset")
-        xml_urlset.attrib = {
-            "xmlns": "http://www.sitemaps.org/schemas/sitemap/0.9"
-        }
-
-        # index
-        xml_url = SubElement(xml_urlset, "url")
-        xml_loc = app.config["DOMAIN"]
-        xml_lastmod = (
-            datetime.now()
-            .replace(microsecond=0, tzinfo=timezone.utc)
-            .isoformat()
+    @app.errorhandler(413)
+    def handle_error_413(error):
+        return (
+            render_template(
+                "error.html",
+                error_code=error.code,
+                error_type=error.name,
+                error_desc="업로드한 파일이 너무 큽니다.",
+            ),
+            error.code,
         )
-        SubElement(xml_url, "loc").text = xml_loc
-        SubElement(xml_url, "lastmod").text = xml_lastmod
-        SubElement(xml_url, "changefreq").text = "daily"
-        SubElement(xml_url, "priority").text = "0.8"
-
-        # posts
-        for post in posts:
-            xml_url = SubElement(xml_urlset, "url")
-            xml_loc = f"{app.config['DOMAIN']}{post['id']}"
-            xml_lastmod = (
-                post["modified"]
-                .replace(microsecond=0, tzinfo=timezone.utc)
-                .isoformat()
-            )
-            SubElement(xml_url, "loc").text = xml_loc
-            SubElement(xml_url, "lastmod").text = xml_lastmod
-            SubElement(xml_url, "changefreq").text = "daily"
-            SubElement(xml_url, "priority").text = "0.5"
-
-        xml_tree = ElementTree(xml_urlset)
-        indent(xml_tree)
-
-        xml_path = path_join(app.static_folder, "sitemap.xml")
-        xml_tree.write(xml_path, encoding="utf-8", xml_declaration=True)
-
-        return send_file(xml_path)
 
     @app.route("/robots.txt", methods=("GET",))
     def show_robots():
@@ -98,5 +92,3 @@ def create_app():
 
     return app
 
-
-create_app()
@@ -1,8 +1,28 @@
-from flask import Blueprint, flash, redirect, render_template, url_for
-from flask_paginate import Pagination, get_page_args
-
-from .auth import admin_only
+import collections
+from datetime import datetime
+
+from flask import (
+    Blueprint,
+    current_app,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from flask_paginate import get_page_args
+
+from . import sitemap
+from .auth import admin_only, invalidate_session_user
+from .blog import invalidate_tags
+from .cache import invalidate_pages
 from .db import get_conn, get_cur
+from .pagination import (
+    KeysetPagination,
+    fetch_page,
+    get_total,
+    invalidate_totals,
+)
 
 BP = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -13,22 +33,26 @@ def view_users():
     per_page = 20
     page, _, offset = get_page_args(per_page=per_page)
 
-    cur = get_cur()
-    cur.execute("SELECT COUNT(*) FROM users;")
-    total = cur.fetchone()[0]
-
-    cur.execute(
-        "SELECT id, username, mail FROM users ORDER BY id "
-        "DESC LIMIT %s OFFSET %s;",
-        (per_page, offset),
+    total = get_total(
+        "users", "SELECT COUNT(*) FROM users;", estimate_table="users"
+    )
+    users, prev_cursor, next_cursor = fetch_page(
+        "SELECT id, username, mail FROM users",
+        list(),
+        list(),
+        (("id", "id", int),),
+        page,
+        per_page,
+        offset,
     )
-    users = cur.fetchall()
 
     return render_template(
         "admin/users.html",
         users=users,
         total=total,
-        pagination=Pagination(
+        pagination=KeysetPagination(
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
             page=page,
             total=total,
             per_page=per_page,
@@ -49,6 +73,11 @@ def delete_user(id):
     cur = get_cur()
     cur.execute("DELETE FROM users WHERE id = %s;", (id,))
     conn.commit()
+    invalidate_session_user(id)
+    invalidate_totals()
+    invalidate_pages("all")
+    invalidate_tags()
+    sitemap.invalidate()
     flash("사용자를 삭제했습니다.", "info")
 
     return redirect(url_for("admin.view_users"))
@@ -60,23 +89,29 @@ def view_comments():
     per_page = 10
     page, _, offset = get_page_args(per_page=per_page)
 
-    cur = get_cur()
-    cur.execute("SELECT COUNT(*) FROM comments;")
-    total = cur.fetchone()[0]
-
-    cur.execute(
-        "SELECT c.id, username, post_id, body "
-        "FROM comments c JOIN users u ON c.author_id = u.id "
-        "ORDER BY modified DESC LIMIT %s OFFSET %s;",
-        (per_page, offset),
+    total = get_total(
+        "comments",
+        "SELECT COUNT(*) FROM comments;",
+        estimate_table="comments",
+    )
+    comments, prev_cursor, next_cursor = fetch_page(
+        "SELECT c.id, username, post_id, body, modified "
+        "FROM comments c JOIN users u ON c.author_id = u.id",
+        list(),
+        list(),
+        (("c.modified", "modified", datetime), ("c.id", "id", int)),
+        page,
+        per_page,
+        offset,
     )
-    comments = cur.fetchall()
 
     return render_template(
         "admin/comments.html",
         comments=comments,
         total=total,
-        pagination=Pagination(
+        pagination=KeysetPagination(
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
             page=page,
             total=total,
             per_page=per_page,
@@ -95,9 +130,76 @@ def view_comments():
 def delete_comment(id):
     conn = get_conn()
     cur = get_cur()
-    cur.execute("DELETE FROM comments WHERE id = %s;", (id,))
+    cur.execute(
+        "DELETE FROM comments WHERE id = %s RETURNING post_id;", (id,)
+    )
+    deleted = cur.fetchone()
     conn.commit()
+    invalidate_totals()
+    if deleted is not None:
+        invalidate_pages("listing", f"post:{deleted['post_id']}")
     flash("댓글을 삭제했습니다.", "info")
 
     return redirect(url_for("admin.view_comments"))
 
+
+@BP.route("/profiler", methods=("GET", "POST"))
+@admin_only
+def view_profiler():
+    profiler = current_app.extensions["profiler"]
+
+    if request.method == "POST":
+        endpoint = request.form.get("endpoint", str()).strip()
+        if endpoint and endpoint not in current_app.view_functions:
+            flash("존재하지 않는 엔드포인트입니다.", "warning")
+        else:
+            profiler.save_settings(
+                enabled=bool(request.form.get("enabled")),
+                rate=max(request.form.get("rate", 100, type=int), 1),
+                endpoint=endpoint,
+                interval=max(request.form.get("interval", 10, type=float), 1)
+                / 1000,
+            )
+            flash("프로파일러 설정을 저장했습니다.", "info")
+
+        return redirect(url_for("admin.view_profiler"))
+
+    stacks = profiler.load_stacks()
+    leaves = collections.Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rpartition(";")[2]] += count
+
+    return render_template(
+        "admin/profiler.html",
+        settings=profiler.get_settings(),
+        endpoints=sorted(current_app.view_functions),
+        total=sum(stacks.values()),
+        stack_count=len(stacks),
+        leaves=leaves.most_common(20),
+    )
+
+
+@BP.route("/profiler/stacks.txt", methods=("GET",))
+@admin_only
+def download_profile():
+    stacks = current_app.extensions["profiler"].load_stacks()
+    response = current_app.response_class(
+        "".join(
+            f"{stack} {count}\n" for stack, count in sorted(stacks.items())
+        ),
+        mimetype="text/plain",
+    )
+    response.headers["Content-Disposition"] = (
+        "attachment; filename=profile.folded"
+    )
+
+    return response
+
+
+@BP.route("/profiler/reset", methods=("POST",))
+@admin_only
+def reset_profile():
+    current_app.extensions["profiler"].reset()
+    flash("수집한 프로파일을 지웠습니다.", "info")
+
+    return redirect(url_for("admin.view_profiler"))
@@ -1,7 +1,9 @@
 import functools, re
+from datetime import datetime
 
 from flask import (
     Blueprint,
+    current_app,
     flash,
     g,
     redirect,
@@ -10,18 +12,41 @@ from flask import (
     session,
     url_for,
 )
-from flask_paginate import Pagination, get_page_args
-from markdown import markdown
+from flask_paginate import get_page_args
 from werkzeug.exceptions import abort
 from werkzeug.security import (
     check_password_hash,
     generate_password_hash,
 )
 
-from .db import get_conn, get_cur
+from .cache import (
+    TTLCache,
+    bump_generation,
+    get_generation,
+    invalidate_pages,
+)
+from .conditional import check_conditional
+from .db import get_conn, get_cur, use_primary
+from .pagination import (
+    KeysetPagination,
+    fetch_page,
+    get_total,
+    invalidate_totals,
+)
+from .render import render_markdown
 
 BP = Blueprint("auth", __name__, url_prefix="/auth")
 
+USERLESS_ENDPOINTS = {
+    "static",
+    "show_robots",
+    "sitemap.show_sitemap",
+    "sitemap.show_sitemap_shard",
+    "blog.detail_file",
+}
+
+_session_users = TTLCache(maxsize=1024, ttl=60.0)
+
 
 def login_required(view):
     @functools.wraps(view)
@@ -86,6 +111,7 @@ def register():
                         (username, generate_password_hash(password), mail,),
                     )
                     conn.commit()
+                    invalidate_totals()
                     flash("가입 성공하였습니다.", "info")
                     return redirect(url_for("auth.login"))
 
@@ -135,7 +161,8 @@ def login():
 def get_user(id):
     cur = get_cur()
     cur.execute(
-        "SELECT id, username, mail, about, password FROM users WHERE id = %s;",
+        "SELECT id, username, mail, about, about_html, password "
+        "FROM users WHERE id = %s;",
         (id,),
     )
     user = cur.fetchone()
@@ -146,14 +173,55 @@ def get_user(id):
     return user
 
 
+def get_session_user(user_id):
+    # Another worker may have renamed or deleted the user; it bumps the
+    # user's generation so every worker drops its cached copy.
+    generation = get_generation(f"user:{user_id}")
+    entry = _session_users.get(user_id)
+    user = None if entry is None or entry[0] != generation else entry[1]
+
+    if user is None:
+        use_primary()
+        cur = get_cur()
+        cur.execute(
+            "SELECT id, username FROM users WHERE id = %s;", (user_id,)
+        )
+        row = cur.fetchone()
+
+        if row is None:
+            return None
+
+        user = {"id": row["id"], "username": row["username"]}
+        _session_users.ttl = current_app.config.get("USER_CACHE", {}).get(
+            "TTL", 60.0
+        )
+        _session_users.set(user_id, (generation, user))
+
+    return user
+
+
+def invalidate_session_user(user_id):
+    _session_users.pop(user_id)
+    bump_generation(f"user:{user_id}")
+
+
 @BP.before_app_request
 def load_logged_in_user():
+    # Checked before touching the session so that these responses do not
+    # get a "Vary: Cookie" header and stay cacheable by shared caches.
+    if request.endpoint in USERLESS_ENDPOINTS:
+        g.user = None
+        return
+
     user_id = session.get("user_id")
 
     if user_id is None:
         g.user = None
     else:
-        g.user = get_user(user_id)
+        g.user = get_session_user(user_id)
+
+        if g.user is None:
+            session.clear()
 
 
 @BP.route("/logout")
@@ -166,32 +234,46 @@ def logout():
 
 @BP.route("/<int:id>", methods=("GET",))
 def userinfo(id):
-    cur = get_cur()
     user = get_user(id)
-    about = markdown(
-        user["about"], extensions=["nl2br", "tables", "fenced_code"],
-    )
+    about = user["about_html"]
 
     per_page = 5
     page, _, offset = get_page_args(per_page=per_page)
 
-    cur.execute("SELECT COUNT(*) FROM posts WHERE author_id = %s;", (id,))
-    total = cur.fetchone()[0]
+    total = get_total(
+        f"posts:author:{id}",
+        "SELECT COUNT(*) FROM posts WHERE author_id = %s;",
+        (id,),
+    )
+    posts, prev_cursor, next_cursor = fetch_page(
+        "SELECT p.id, title, excerpt, created, modified FROM posts p",
+        ["author_id = %s"],
+        [id],
+        (("p.created", "created", datetime), ("p.id", "id", int)),
+        page,
+        per_page,
+        offset,
+    )
 
-    cur.execute(
-        "SELECT id, title, body, created, modified, author_id, views "
-        "FROM posts WHERE author_id = %s ORDER BY created DESC "
-        "LIMIT %s OFFSET %s;",
-        (id, per_page, offset),
+    not_modified = check_conditional(
+        "auth.userinfo",
+        request.full_path,
+        user["username"],
+        user["about_html"],
+        total,
+        [(post["id"], post["modified"]) for post in posts],
     )
-    posts = cur.fetchall()
+    if not_modified:
+        return not_modified
 
     return render_template(
         "auth/userinfo.html",
         user=user,
         about=about,
         posts=posts,
-        pagination=Pagination(
+        pagination=KeysetPagination(
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
             page=page,
             total=total,
             per_page=per_page,
@@ -255,22 +337,34 @@ def update(id):
                     if password:
                         cur.execute(
                             "UPDATE users SET username = %s, password = %s, "
-                            "mail = %s, about = %s WHERE id = %s;",
+                            "mail = %s, about = %s, about_html = %s "
+                            "WHERE id = %s;",
                             (
                                 username,
                                 generate_password_hash(password),
                                 mail,
                                 about,
+                                render_markdown(about),
                                 id,
                             ),
                         )
                     else:
                         cur.execute(
                             "UPDATE users SET username = %s, password = %s, "
-                            "mail = %s, about = %s WHERE id = %s;",
-                            (username, user["password"], mail, about, id,),
+                            "mail = %s, about = %s, about_html = %s "
+                            "WHERE id = %s;",
+                            (
+                                username,
+                                user["password"],
+                                mail,
+                                about,
+                                render_markdown(about),
+                                id,
+                            ),
                         )
                     conn.commit()
+                    invalidate_session_user(id)
+                    invalidate_pages("all")
                     flash("사용자 정보를 수정했습니다.", "info")
                     return redirect(url_for("auth.userinfo", id=id))
 
@@ -1,98 +1,163 @@
-import os, re
+import mimetypes, os, time
+from datetime import datetime
+from types import MappingProxyType
+from urllib.parse import quote
+
 from flask import (
     Blueprint,
     current_app,
     flash,
     g,
+    jsonify,
     redirect,
     render_template,
     request,
     send_file,
     url_for,
 )
-from flask_paginate import Pagination, get_page_args
-from markdown import markdown
+from flask_paginate import get_page_args
 from werkzeug.exceptions import abort
-from werkzeug.utils import secure_filename
 
+from . import sitemap
 from .auth import admin_only, login_required
-from .db import get_conn, get_cur
+from .cache import (
+    TTLCache,
+    bump_generation,
+    cached_page,
+    get_generation,
+    invalidate_pages,
+)
+from .conditional import check_conditional
+from .counter import count_view
+from .db import get_conn, get_cur, use_primary
+from .images import (
+    get_variants,
+    pick_variant,
+    schedule_variants,
+)
+from .pagination import (
+    KeysetPagination,
+    decode_cursor,
+    encode_cursor,
+    fetch_page,
+    get_total,
+    invalidate_totals,
+)
+from .render import VERSION_LENGTH, render_post
+from .search import search_posts, update_search_vector
+from .uploads import save_attachments
 
 BP = Blueprint("blog", __name__)
 
+POST_KEYS = (("p.created", "created", datetime), ("p.id", "id", int))
+COMMENTS_PER_PAGE = 50
+
+_file_records = TTLCache(maxsize=4096, ttl=300.0)
+
 
 def get_all_tags():
-    cur = get_cur()
-    cur.execute("SELECT * FROM tags ORDER BY title;")
-    tags = cur.fetchall()
+    catalogue = current_app.extensions.setdefault("tag_catalogue", dict())
+    generation = get_generation("tags")
+    # Tags are also added and renamed directly in the database, which no
+    # post write announces, so the catalogue expires on its own as well.
+    ttl = current_app.config.get("TAG_CACHE", {}).get("TTL", 300.0)
+    now = time.monotonic()
+
+    if (
+        catalogue.get("generation") != generation
+        or now - catalogue["loaded"] >= ttl
+    ):
+        use_primary()
+        cur = get_cur()
+        cur.execute("SELECT id, title, post_count FROM tags ORDER BY title;")
+        catalogue["tags"] = tuple(
+            {
+                "id": tag["id"],
+                "title": tag["title"],
+                "count": tag["post_count"],
+            }
+            for tag in cur.fetchall()
+        )
+        catalogue["loaded"] = now
+        catalogue["generation"] = generation
+
+    return catalogue["tags"]
 
-    return tags
+
+def invalidate_tags():
+    bump_generation("tags")
 
 
 @BP.route("/", methods=("GET", "POST"))
+@cached_page("listing")
 def index():
     per_page = 10
     page, _, offset = get_page_args(per_page=per_page)
-    tag_id = request.args.get("tag_id", 0)
+    tag_id = request.args.get("tag_id", 0, type=int)
 
-    cur = get_cur()
     if request.method == "POST":
-        query = request.form["query"].replace("<script>", "&lt;script&gt;")
-        query_for_like = ("%" + query + "%").lower()
-        cur.execute(
-            "SELECT COUNT(*) FROM posts "
-            "WHERE (LOWER(title) LIKE %s) OR (LOWER(body) LIKE %s);",
-            (query_for_like, query_for_like),
-        )
-        total = cur.fetchone()[0]
-        cur.execute(
-            "SELECT p.id, title, body, created, modified, author_id, views, "
-            "username "
-            "FROM posts p JOIN users u ON p.author_id = u.id "
-            "WHERE (LOWER(title) LIKE %s) OR (LOWER(body) LIKE %s) "
-            "ORDER BY created DESC LIMIT %s OFFSET %s;",
-            (query_for_like, query_for_like, per_page, offset),
-        )
-    elif tag_id:
-        cur.execute(
-            "SELECT COUNT(*) FROM posts p "
-            "JOIN post2tag pt ON p.id = pt.post_id WHERE pt.tag_id = %s;",
-            (tag_id,),
-        )
-        total = cur.fetchone()[0]
-        cur.execute(
-            "SELECT p.id, title, body, created, modified, author_id, views, "
-            "username "
-            "FROM posts p JOIN users u ON p.author_id = u.id "
-            "JOIN post2tag pt ON p.id = pt.post_id WHERE pt.tag_id = %s "
-            "ORDER BY created DESC LIMIT %s OFFSET %s;",
-            (tag_id, per_page, offset),
-        )
+        return redirect(url_for("blog.index", q=request.form["query"]))
+
+    query = request.args.get("q", "").strip()
+
+    all_tags = get_all_tags()
+
+    prev_cursor = next_cursor = None
+    if query:
+        total, posts = search_posts(query, per_page, offset)
     else:
-        cur.execute("SELECT COUNT(*) FROM posts p;")
-        total = cur.fetchone()[0]
-        cur.execute(
-            "SELECT p.id, title, body, created, modified, author_id, views, "
-            "username "
-            "FROM posts p JOIN users u ON p.author_id = u.id "
-            "ORDER BY created DESC LIMIT %s OFFSET %s;",
-            (per_page, offset),
+        select = (
+            "SELECT p.id, title, excerpt, created, modified, author_id, "
+            "views, username, comment_count "
+            "FROM posts p JOIN users u ON p.author_id = u.id"
         )
-    posts = cur.fetchall()
-
-    total_comments = list()
-    for post in posts:
-        cur.execute(
-            "SELECT COUNT(*) FROM comments WHERE post_id = %s;", (post["id"],)
+        if tag_id:
+            total = next(
+                (tag["count"] for tag in all_tags if tag["id"] == tag_id), 0
+            )
+            select += " JOIN post2tag pt ON p.id = pt.post_id"
+            where, params = ["pt.tag_id = %s"], [tag_id]
+        else:
+            total = get_total(
+                "posts", "SELECT COUNT(*) FROM posts;", estimate_table="posts"
+            )
+            where, params = list(), list()
+
+        posts, prev_cursor, next_cursor = fetch_page(
+            select,
+            where,
+            params,
+            POST_KEYS,
+            page,
+            per_page,
+            offset,
         )
-        total_comments.append(cur.fetchone()[0])
 
-    all_tags = get_all_tags()
+    not_modified = check_conditional(
+        "blog.index",
+        request.full_path,
+        total,
+        [
+            (
+                post["id"],
+                post["modified"],
+                post["views"],
+                post["comment_count"],
+            )
+            for post in posts
+        ],
+        all_tags,
+        last_modified=max((post["modified"] for post in posts), default=None),
+    )
+    if not_modified:
+        return not_modified
 
     return render_template(
         "blog/index.html",
         posts=posts,
-        pagination=Pagination(
+        pagination=KeysetPagination(
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
             page=page,
             total=total,
             per_page=per_page,
@@ -105,12 +170,43 @@ def index():
         bs_version=5,
         total=total,
         all_tags=all_tags,
-        tag_id=int(tag_id),
-        total_comments=total_comments,
-        zip=zip,
+        tag_id=tag_id,
+        query=query,
     )
 
 
+def get_submitted_tag_ids(all_tags):
+    return [
+        tag["id"] for tag in all_tags if request.form.get(f"tag-{tag['id']}")
+    ]
+
+
+def get_submitted_files():
+    return [
+        file_obj
+        for file_obj in request.files.getlist("file")
+        if file_obj.filename != str()
+    ]
+
+
+def save_tags(cur, post_id, tag_ids, current_tag_ids=()):
+    """Apply the difference between a post's current and submitted tags."""
+    removed = sorted(set(current_tag_ids) - set(tag_ids))
+    added = sorted(set(tag_ids) - set(current_tag_ids))
+
+    if removed:
+        cur.execute(
+            "DELETE FROM post2tag WHERE post_id = %s AND tag_id = ANY(%s);",
+            (post_id, removed),
+        )
+    if added:
+        cur.execute(
+            "INSERT INTO post2tag (post_id, tag_id) "
+            "SELECT %s, unnest(%s::integer[]) ON CONFLICT DO NOTHING;",
+            (post_id, added),
+        )
+
+
 @BP.route("/create", methods=("GET", "POST"))
 @admin_only
 @login_required
@@ -120,45 +216,31 @@ def create():
     if request.method == "POST":
         title = request.form["title"].replace("<script>", "&lt;script&gt;")
         body = request.form["body"].replace("<script>", "&lt;script&gt;")
-        files = request.files.getlist("file")
+        files = get_submitted_files()
 
         conn = get_conn()
         cur = get_cur()
-        cur.execute(
-            "INSERT INTO posts (title, body, author_id, views) "
-            "VALUES (%s, %s, %s, 0);",
-            (title, body, g.user["id"]),
-        )
-        conn.commit()
-
-        cur.execute("SELECT MAX(id) FROM posts;")
-        post_id = cur.fetchone()[0]
-
-        for tag in all_tags:
-            if request.form.get(f"tag-{tag['id']}"):
-                cur.execute(
-                    "INSERT INTO post2tag (post_id, tag_id) VALUES (%s, %s);",
-                    (post_id, tag["id"]),
-                )
-
-        for file_obj in files:
-            if file_obj.filename == str():
-                break
-
-            upload_dir = os.path.join(current_app.instance_path, str(post_id))
-            if not os.path.isdir(upload_dir):
-                os.makedirs(upload_dir)
-
-            file_path = os.path.join(
-                upload_dir, secure_filename(file_obj.filename)
-            )
-            file_obj.save(file_path)
+        try:
             cur.execute(
-                "INSERT INTO files (post_id, file_path) VALUES (%s, %s);",
-                (post_id, file_path),
+                "INSERT INTO posts (title, body, author_id, views) "
+                "VALUES (%s, %s, %s, 0) RETURNING id;",
+                (title, body, g.user["id"]),
             )
-
-        conn.commit()
+            post_id = cur.fetchone()[0]
+            update_search_vector(cur, post_id)
+            save_tags(cur, post_id, get_submitted_tag_ids(all_tags))
+            attachment_ids = save_attachments(cur, post_id, files)
+            render_post(cur, post_id, body)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        schedule_variants(attachment_ids)
+        invalidate_totals()
+        sitemap.invalidate()
+        invalidate_pages("listing")
+        invalidate_tags()
         flash("글을 등록했습니다.", "info")
         return redirect(url_for("blog.detail", id=post_id))
 
@@ -168,8 +250,8 @@ def create():
 def get_post(id):
     cur = get_cur()
     cur.execute(
-        "SELECT p.id, author_id, created, modified, title, body, views, "
-        "username FROM posts p JOIN users u ON p.author_id = u.id "
+        "SELECT p.id, author_id, created, modified, title, body, body_html, "
+        "views, username FROM posts p JOIN users u ON p.author_id = u.id "
         "WHERE p.id = %s;",
         (id,),
     )
@@ -181,145 +263,340 @@ def get_post(id):
     return post
 
 
-def get_tags_from_post_id(post_id):
+def freeze(record, timestamps=()):
+    record = dict(record)
+    for key in timestamps:
+        if isinstance(record[key], str):
+            record[key] = datetime.fromisoformat(record[key])
+
+    return MappingProxyType(record)
+
+
+def load_post(id):
+    """Load a post with its author, tags, files and comments at once.
+
+    The result is a read-only mapping; ``tags``, ``files`` and
+    ``comments`` are tuples of read-only mappings.
+    """
     cur = get_cur()
     cur.execute(
-        "SELECT t.id, title FROM post2tag pt JOIN tags t ON pt.tag_id = t.id "
-        "WHERE post_id = %s ORDER BY title;",
-        (post_id,),
+        "SELECT p.id, author_id, created, modified, title, body, body_html, "
+        "views, username, "
+        "(SELECT COALESCE(json_agg(json_build_object("
+        "'id', t.id, 'title', t.title) ORDER BY t.title), '[]') "
+        "FROM post2tag pt JOIN tags t ON pt.tag_id = t.id "
+        "WHERE pt.post_id = p.id) AS tags, "
+        "(SELECT COALESCE(json_agg(json_build_object("
+        "'id', f.id, 'file_name', f.file_name, 'file_path', f.file_path) "
+        "ORDER BY f.id), '[]') "
+        "FROM files f WHERE f.post_id = p.id) AS files, "
+        "(SELECT COALESCE(json_agg(c ORDER BY c.created, c.id), '[]') "
+        "FROM (SELECT c.id, c.author_id, c.created, c.modified, c.body, "
+        "cu.username FROM comments c JOIN users cu ON c.author_id = cu.id "
+        "WHERE c.post_id = p.id ORDER BY c.created, c.id LIMIT %s) c"
+        ") AS comments, "
+        "comment_count, comments_changed "
+        "FROM posts p JOIN users u ON p.author_id = u.id WHERE p.id = %s;",
+        (COMMENTS_PER_PAGE + 1, id),
     )
-    tags = cur.fetchall()
+    post = cur.fetchone()
 
-    if tags is None:
+    if post is None:
         abort(404)
 
-    return tags
+    post = dict(post)
+    post["tags"] = tuple(freeze(tag) for tag in post["tags"])
+    post["files"] = tuple(freeze(file_record) for file_record in post["files"])
+    post["comments"], post["next_comments"] = page_comments(post["comments"])
 
+    return MappingProxyType(post)
 
-def get_files_from_post_id(post_id):
-    cur = get_cur()
-    cur.execute(
-        "SELECT id, file_path FROM files WHERE post_id = %s;", (post_id,)
+
+def page_comments(comments):
+    comments = tuple(
+        freeze(comment, timestamps=("created", "modified"))
+        for comment in comments
     )
-    files = cur.fetchall()
 
-    return files
+    if len(comments) > COMMENTS_PER_PAGE:
+        comments = comments[:COMMENTS_PER_PAGE]
+        last = comments[-1]
+        return comments, encode_cursor((last["created"], last["id"]))
+
+    return comments, None
 
 
-def get_comments_from_post_id(post_id):
+def get_comments_page(post_id, after=None):
+    where = "post_id = %s"
+    params = [post_id]
+    if after is not None:
+        where += " AND (created, c.id) > (%s, %s)"
+        params.extend(after)
+
     cur = get_cur()
     cur.execute(
         "SELECT c.id, author_id, created, modified, body, username "
         "FROM comments c JOIN users u ON c.author_id = u.id "
-        "WHERE post_id = %s ORDER BY created;",
-        (post_id,),
+        f"WHERE {where} ORDER BY created, c.id LIMIT %s;",
+        (*params, COMMENTS_PER_PAGE + 1),
     )
-    comments = cur.fetchall()
 
-    if comments is None:
-        abort(404)
-
-    return comments
+    return page_comments(cur.fetchall())
 
 
 @BP.route("/<int:id>", methods=("GET",))
 def detail(id):
-    post = get_post(id)
-    tags = get_tags_from_post_id(id)
-    files = get_files_from_post_id(id)
-    comments = get_comments_from_post_id(id)
-    body = markdown(post["body"], extensions=["nl2br", "tables", "fenced_code"])
-
-    for file_record in files:
-        file_name = os.path.basename(file_record["file_path"])
-        file_id = file_record["id"]
-        body = re.sub(f'src="{file_name}"', f'src="{id}/{file_id}"', body)
+    # show_detail aborts with 404 for a missing post, so only views of
+    # posts that exist are counted.
+    response = show_detail(id=id)
+    count_view(id)
+
+    return response
+
+
+@cached_page("post:{id}")
+def show_detail(id):
+    post = load_post(id)
+    not_modified = check_conditional(
+        "blog.detail",
+        id,
+        post["modified"],
+        post["username"],
+        post["comment_count"],
+        post["comments_changed"],
+        [(comment["id"], comment["username"]) for comment in post["comments"]],
+        last_modified=max(
+            filter(None, (post["modified"], post["comments_changed"]))
+        ),
+    )
+    if not_modified:
+        return not_modified
 
-    conn = get_conn()
-    cur = get_cur()
-    cur.execute(
-        "UPDATE posts SET views = %s WHERE id = %s;", (post["views"] + 1, id),
+    return render_template(
+        "blog/detail.html",
+        post=post,
+        body=post["body_html"],
+        tags=post["tags"],
+        comments=post["comments"],
+        next_comments=post["next_comments"],
     )
-    conn.commit()
+
+
+@BP.route("/<int:post_id>/comments", methods=("GET",))
+@cached_page("post:{post_id}")
+def show_comments(post_id):
+    after = None
+    if request.args.get("after"):
+        after = decode_cursor(request.args["after"], (datetime, int))
+        if after is None:
+            abort(400)
+
+    comments, next_comments = get_comments_page(post_id, after)
+
+    if request.args.get("format") == "json":
+        return jsonify(
+            comments=[
+                {
+                    "id": comment["id"],
+                    "author_id": comment["author_id"],
+                    "username": comment["username"],
+                    "created": comment["created"].isoformat(),
+                    "body": comment["body"],
+                }
+                for comment in comments
+            ],
+            next=next_comments,
+        )
 
     return render_template(
-        "blog/detail.html", post=post, body=body, tags=tags, comments=comments
+        "blog/comments.html",
+        post_id=post_id,
+        comments=comments,
+        next_comments=next_comments,
+    )
+
+
+def get_file_record(post_id, file_id):
+    record = _file_records.get((post_id, file_id))
+
+    if record is None:
+        use_primary()
+        cur = get_cur()
+        cur.execute(
+            "SELECT file_name, file_path, blob_hash FROM files "
+            "WHERE id = %s AND post_id = %s;",
+            (file_id, post_id),
+        )
+        file_record = cur.fetchone()
+
+        if file_record is None:
+            abort(404)
+
+        file_path = file_record["file_path"]
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            abort(404)
+
+        if file_record["blob_hash"]:
+            etag = f"{file_id}-{file_record['blob_hash']}"
+        else:
+            etag = f"{file_id}-{stat.st_size}-{stat.st_mtime_ns}"
+
+        stem = os.path.splitext(file_record["file_name"])[0]
+        variants = list()
+        for width, format_name, variant_path, size in get_variants(
+            cur, file_id
+        ):
+            try:
+                variant_stat = os.stat(variant_path)
+            except FileNotFoundError:
+                continue
+
+            variants.append(
+                (
+                    width,
+                    format_name,
+                    {
+                        "path": variant_path,
+                        "name": f"{stem}-{width}.{format_name}",
+                        "size": size,
+                        "mtime": variant_stat.st_mtime,
+                        "etag": f"{etag}-{width}{format_name}",
+                    },
+                )
+            )
+
+        record = {
+            "path": file_path,
+            "name": file_record["file_name"],
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "etag": etag,
+            "hash": file_record["blob_hash"],
+            "variants": variants,
+        }
+        _file_records.set((post_id, file_id), record)
+
+    return record
+
+
+def offload_file(record, header, value, max_age):
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(record["name"])[0]
+        or "application/octet-stream"
     )
+    response.headers[header] = value
+    response.headers["Content-Disposition"] = (
+        f"inline; filename*=UTF-8''{quote(record['name'])}"
+    )
+    response.set_etag(record["etag"])
+    response.last_modified = record["mtime"]
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+
+    return response.make_conditional(request)
 
 
 @BP.route("/<int:id>/<int:file_id>", methods=("GET",))
 def detail_file(id, file_id):
-    cur = get_cur()
-    cur.execute("SELECT file_path FROM files WHERE id = %s;", (file_id,))
-    file_record = cur.fetchone()
-
-    if file_record is None:
-        abort(404)
+    record = get_file_record(id, file_id)
+    version = request.args.get("v")
+    current = (record["hash"] or str())[:VERSION_LENGTH]
+    if version and version != current:
+        # Another worker may have changed the file since we cached it.
+        _file_records.pop((id, file_id))
+        record = get_file_record(id, file_id)
+        current = (record["hash"] or str())[:VERSION_LENGTH]
+
+    files_config = current_app.config.get("FILES", {})
+    offload = files_config.get("OFFLOAD")
+    # Only a URL naming the current content may be cached for long; the
+    # content behind a bare URL changes when the file is uploaded again.
+    if version and version == current:
+        max_age = files_config.get("MAX_AGE", 7 * 24 * 3600)
+    else:
+        max_age = 0
+
+    width = request.args.get("w", type=int)
+    if width and record["variants"]:
+        if "image/webp" in request.headers.get("Accept", str()):
+            formats = ("webp", "jpeg")
+        else:
+            formats = ("jpeg",)
+        variant = pick_variant(record["variants"], width, formats)
+        if variant is not None:
+            record = variant[2]
+
+    if offload == "x-accel-redirect":
+        relative_path = os.path.relpath(
+            record["path"], current_app.instance_path
+        )
+        response = offload_file(
+            record,
+            "X-Accel-Redirect",
+            files_config.get("ACCEL_PREFIX", "/_files/")
+            + quote(relative_path),
+            max_age,
+        )
+    elif offload == "x-sendfile":
+        response = offload_file(
+            record, "X-Sendfile", record["path"], max_age
+        )
+    else:
+        response = send_file(
+            record["path"],
+            download_name=record["name"],
+            conditional=True,
+            etag=record["etag"],
+            last_modified=record["mtime"],
+            max_age=max_age,
+        )
 
-    file_path = file_record["file_path"]
+    if width:
+        response.vary.add("Accept")
 
-    return send_file(file_path, download_name=os.path.basename(file_path))
+    return response
 
 
 @BP.route("/<int:id>/update", methods=("GET", "POST"))
 @login_required
 def update(id):
-    post = get_post(id)
+    post = load_post(id)
     if post["author_id"] != g.user["id"]:
         abort(403)
 
-    tag_ids = [tag["id"] for tag in get_tags_from_post_id(id)]
-    file_ids = [
-        os.path.basename(file_record["file_path"])
-        for file_record in get_files_from_post_id(id)
-    ]
+    tag_ids = [tag["id"] for tag in post["tags"]]
+    file_ids = [file_record["file_name"] for file_record in post["files"]]
     all_tags = get_all_tags()
 
     if request.method == "POST":
         title = request.form["title"].replace("<script>", "&lt;script&gt;")
         body = request.form["body"].replace("<script>", "&lt;script&gt;")
-        files = request.files.getlist("file")
+        files = get_submitted_files()
 
         conn = get_conn()
         cur = get_cur()
-        cur.execute(
-            "UPDATE posts SET title = %s, body = %s, "
-            "modified = CURRENT_TIMESTAMP WHERE id = %s;",
-            (title, body, id),
-        )
-
-        for tag in all_tags:
-            if request.form.get(f"tag-{tag['id']}"):
-                if tag["id"] in tag_ids:
-                    continue
-                cur.execute(
-                    "INSERT INTO post2tag (post_id, tag_id) VALUES (%s, %s);",
-                    (id, tag["id"]),
-                )
-            else:
-                cur.execute(
-                    "DELETE FROM post2tag WHERE post_id = %s AND tag_id = %s",
-                    (id, tag["id"]),
-                )
-
-        for file_obj in files:
-            if file_obj.filename == str():
-                break
-
-            upload_dir = os.path.join(current_app.instance_path, str(id))
-            if not os.path.isdir(upload_dir):
-                os.makedirs(upload_dir)
-
-            file_path = os.path.join(
-                upload_dir, secure_filename(file_obj.filename)
-            )
-            file_obj.save(file_path)
+        try:
             cur.execute(
-                "INSERT INTO files (post_id, file_path) VALUES (%s, %s);",
-                (id, file_path),
+                "UPDATE posts SET title = %s, body = %s, "
+                "modified = CURRENT_TIMESTAMP WHERE id = %s;",
+                (title, body, id),
             )
-
-        conn.commit()
+            update_search_vector(cur, id)
+            save_tags(cur, id, get_submitted_tag_ids(all_tags), tag_ids)
+            attachment_ids = save_attachments(cur, id, files)
+            render_post(cur, id, body)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        _file_records.clear()
+        schedule_variants(attachment_ids)
+        sitemap.invalidate()
+        invalidate_pages("listing", f"post:{id}")
+        invalidate_tags()
         flash("글을 수정했습니다.", "info")
         return redirect(url_for("blog.detail", id=id))
 
@@ -344,6 +621,11 @@ def delete(id):
     cur.execute("DELETE FROM post2tag WHERE post_id = %s;", (id,))
     cur.execute("DELETE FROM posts WHERE id = %s;", (id,))
     conn.commit()
+    _file_records.clear()
+    invalidate_totals()
+    sitemap.invalidate()
+    invalidate_pages("listing", f"post:{id}")
+    invalidate_tags()
     flash("글을 삭제했습니다.", "info")
 
     return redirect(url_for("blog.index"))
@@ -361,6 +643,8 @@ def create_comment(post_id):
         (post_id, g.user["id"], body),
     )
     conn.commit()
+    invalidate_totals()
+    invalidate_pages("listing", f"post:{post_id}")
     flash("댓글을 등록했습니다.", "info")
 
     return redirect(url_for("blog.detail", id=post_id, _anchor="comments"))
@@ -392,6 +676,8 @@ def delete_comment(id, post_id):
     cur = get_cur()
     cur.execute("DELETE FROM comments WHERE id = %s;", (id,))
     conn.commit()
+    invalidate_totals()
+    invalidate_pages("listing", f"post:{post_id}")
     flash("댓글을 삭제했습니다.", "info")
 
     return redirect(url_for("blog.detail", id=post_id, _anchor="comments"))
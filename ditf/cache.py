@@ -0,0 +1,286 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import functools, hashlib, json, os, tempfile, threading, time
+
+from flask import current_app, g, make_response, request, session
+
+from .conditional import check_validators
+from .db import use_primary
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class MemoryBackend:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+
+            self._data[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class FileSystemBackend:
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as entry_fh:
+                return entry_fh.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_fh:
+            tmp_fh.write(value)
+        os.replace(tmp_path, self._path(key))
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        entries = list()
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def get_generation_path(tag):
+    generation_dir = os.path.join(
+        current_app.instance_path, "cache", "generations"
+    )
+    os.makedirs(generation_dir, exist_ok=True)
+
+    return os.path.join(generation_dir, tag.replace(":", "-"))
+
+
+def get_generation(tag):
+    try:
+        with open(get_generation_path(tag), "r") as gen_fh:
+            return gen_fh.read()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_generation(*tags):
+    for tag in tags:
+        path = get_generation_path(tag)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as tmp_fh:
+            tmp_fh.write(f"{time.time_ns()}-{os.getpid()}")
+        os.replace(tmp_path, path)
+
+
+class PageCache:
+    def __init__(self, backend, ttl=300.0):
+        self.backend = backend
+        self.ttl = ttl
+
+    def make_key(self, tags):
+        parts = [
+            request.endpoint,
+            sorted(request.view_args.items()),
+            sorted(request.args.items(multi=True)),
+            [(tag, get_generation(tag)) for tag in tags],
+        ]
+
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    def load(self, key):
+        data = self.backend.get(key)
+        if data is None:
+            return None
+
+        header, _, body = data.partition(b"\n")
+        meta = json.loads(header)
+        if meta["expires"] < time.time():
+            return None
+
+        return meta, body
+
+    def store(self, key, response, etag=None, last_modified=None):
+        meta = {
+            "expires": time.time() + self.ttl,
+            "mimetype": response.mimetype,
+            "etag": etag,
+            "last_modified": (
+                None if last_modified is None else last_modified.timestamp()
+            ),
+        }
+        self.backend.set(
+            key,
+            json.dumps(meta).encode("utf-8") + b"\n" + response.get_data(),
+        )
+
+
+def is_cacheable():
+    return (
+        request.method == "GET"
+        and g.get("user") is None
+        and not session.get("_flashes")
+    )
+
+
+def cached_page(*tags):
+    """Serve the decorated view from the page cache for anonymous GETs.
+
+    ``tags`` are formatted with the view arguments, e.g. ``"post:{id}"``;
+    bumping any of them with ``invalidate_pages`` drops the entry.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            page_cache = current_app.extensions.get("page_cache")
+            if page_cache is None or not is_cacheable():
+                return view(**kwargs)
+
+            key = page_cache.make_key(
+                ["all"] + [tag.format(**kwargs) for tag in tags]
+            )
+            entry = page_cache.load(key)
+            if entry is not None:
+                meta, body = entry
+                if meta["etag"] is not None:
+                    last_modified = meta["last_modified"]
+                    not_modified = check_validators(
+                        meta["etag"],
+                        None
+                        if last_modified is None
+                        else datetime.fromtimestamp(
+                            last_modified, timezone.utc
+                        ),
+                    )
+                    if not_modified:
+                        return not_modified
+
+                return current_app.response_class(
+                    body, mimetype=meta["mimetype"]
+                )
+
+            use_primary()
+            response = make_response(view(**kwargs))
+            if (
+                response.status_code == 200
+                and not response.direct_passthrough
+                and not session.modified
+            ):
+                page_cache.store(
+                    key,
+                    response,
+                    etag=g.get("etag"),
+                    last_modified=g.get("last_modified"),
+                )
+
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def invalidate_pages(*tags):
+    bump_generation(*tags)
+
+
+def init_app(app):
+    cache_config = app.config.get("PAGE_CACHE", {})
+    backend_name = cache_config.get("BACKEND", "memory")
+
+    if backend_name == "memory":
+        backend = MemoryBackend(cache_config.get("MAX_BYTES", 64 * 1024 ** 2))
+    elif backend_name == "filesystem":
+        backend = FileSystemBackend(
+            os.path.join(app.instance_path, "cache", "pages"),
+            cache_config.get("MAX_BYTES", 256 * 1024 ** 2),
+        )
+    else:
+        return
+
+    app.extensions["page_cache"] = PageCache(
+        backend, ttl=cache_config.get("TTL", 300.0)
+    )
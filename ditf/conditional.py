@@ -0,0 +1,74 @@
+import hashlib, time
+from datetime import timezone
+
+from flask import current_app, g, request, session
+
+
+def compute_etag(*parts):
+    if g.get("user") is None:
+        viewer = ("anonymous",)
+    else:
+        # Pages for logged-in users embed CSRF tokens, so their
+        # validators expire before the tokens do.
+        time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT") or 3600
+        viewer = (g.user["id"], int(time.time() // (time_limit / 2)))
+
+    return hashlib.sha1(repr(parts + viewer).encode("utf-8")).hexdigest()
+
+
+def check_conditional(*parts, last_modified=None):
+    """Attach validators to the response and return a 304 if they match.
+
+    ``parts`` are the cheap values the page is derived from, e.g. row ids
+    and ``modified`` timestamps. Returns ``None`` when the page has to be
+    rendered.
+    """
+    if session.get("_flashes"):
+        return None
+
+    if last_modified is not None and g.get("user") is not None:
+        last_modified = None
+
+    return check_validators(compute_etag(*parts), last_modified)
+
+
+def check_validators(etag, last_modified=None):
+    g.etag = etag
+    if last_modified is not None:
+        g.last_modified = last_modified.replace(
+            microsecond=0, tzinfo=timezone.utc
+        )
+
+    if request.if_none_match:
+        # If-None-Match uses the weak comparison (RFC 7232, 3.2), so tags a
+        # gzipping proxy turned into W/"..." still match.
+        matched = request.if_none_match.contains_weak(g.etag)
+    elif request.if_modified_since and "last_modified" in g:
+        matched = g.last_modified <= request.if_modified_since
+    else:
+        matched = False
+
+    if matched:
+        return current_app.response_class(status=304)
+
+    return None
+
+
+def add_validators(response):
+    etag = g.pop("etag", None)
+    last_modified = g.pop("last_modified", None)
+
+    if etag is not None and response.status_code in (200, 304):
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.vary.add("Cookie")
+        response.cache_control.no_cache = True
+        if g.get("user") is not None:
+            response.cache_control.private = True
+
+    return response
+
+
+def init_app(app):
+    app.after_request(add_validators)
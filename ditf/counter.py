@@ -0,0 +1,119 @@
+import atexit, os, threading, time
+
+from flask import current_app
+import psycopg2.extras
+
+from .db import get_pool
+
+
+class ViewCounter:
+    def __init__(self, app, flush_interval=10.0, max_lag=60.0):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_lag = max_lag
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = dict()
+        self._oldest = None
+        self._thread = None
+        self._pid = None
+
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="view-counter", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Failed to flush view counts.")
+
+    def increment(self, post_id, n=1):
+        with self._lock:
+            self._pending[post_id] = self._pending.get(post_id, 0) + n
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            overdue = time.monotonic() - self._oldest > self.max_lag
+
+        self._ensure_thread()
+        if overdue:
+            self.flush()
+
+    def pending(self, post_id):
+        with self._lock:
+            return self._pending.get(post_id, 0)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, dict()
+                oldest, self._oldest = self._oldest, None
+
+            if not pending:
+                return 0
+
+            pool = get_pool(self.app)
+            try:
+                conn = pool.getconn()
+            except Exception:
+                self._restore(pending, oldest)
+                raise
+
+            try:
+                with conn.cursor() as cur:
+                    psycopg2.extras.execute_values(
+                        cur,
+                        "UPDATE posts p SET views = p.views + v.n "
+                        "FROM (VALUES %s) AS v(id, n) WHERE p.id = v.id;",
+                        sorted(pending.items()),
+                    )
+                conn.commit()
+            except Exception:
+                self._restore(pending, oldest)
+                pool.putconn(conn, broken=True)
+                raise
+
+            pool.putconn(conn)
+
+            return sum(pending.values())
+
+    def _restore(self, pending, oldest):
+        with self._lock:
+            for post_id, n in pending.items():
+                self._pending[post_id] = self._pending.get(post_id, 0) + n
+            if oldest is not None and (
+                self._oldest is None or oldest < self._oldest
+            ):
+                self._oldest = oldest
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception("Failed to flush view counts on exit.")
+
+
+def count_view(post_id):
+    current_app.extensions["view_counter"].increment(post_id)
+
+
+def init_app(app):
+    views_config = app.config.get("VIEWS", {})
+    app.extensions["view_counter"] = ViewCounter(
+        app,
+        flush_interval=views_config.get("FLUSH_INTERVAL", 10.0),
+        max_lag=views_config.get("MAX_LAG", 60.0),
+    )
@@ -1,25 +1,391 @@
+import os, random, re, threading, time
+
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request
 from flask.cli import with_appcontext
-import psycopg2, psycopg2.extras
+import psycopg2, psycopg2.extensions, psycopg2.extras
 
 
-def get_conn():
-    if "conn" not in g:
-        db_config = current_app.config["DATABASE"]
-        g.conn = psycopg2.connect(
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect_kwargs,
+        min_size=1,
+        max_size=10,
+        timeout=30.0,
+        max_idle=300.0,
+        max_lifetime=3600.0,
+        check_interval=30.0,
+    ):
+        self.connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+
+        self._cond = threading.Condition()
+        self._idle = list()  # [(conn, created, last_used)], most recent last
+        self._created = dict()  # id(conn) -> created
+        self._in_use = 0
+        self._waiting = 0
+        self._wait_count = 0
+        self._wait_time = 0.0
+        self._closed = False
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def _recycle_idle(self):
+        now = time.monotonic()
+        kept = list()
+        for conn, created, last_used in self._idle:
+            expired = now - created > self.max_lifetime or (
+                now - last_used > self.max_idle
+                and len(kept) + self._in_use >= self.min_size
+            )
+            if expired:
+                self._discard(conn)
+            else:
+                kept.append((conn, created, last_used))
+        self._idle = kept
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        with self._cond:
+            if self._closed:
+                raise PoolError("connection pool is closed")
+
+            self._recycle_idle()
+            waited = False
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"no connection available within {self.timeout}s"
+                    )
+                if not waited:
+                    waited = True
+                    self._wait_count += 1
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if waited:
+                self._wait_time += time.monotonic() - started
+
+            entry = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        try:
+            if entry is not None:
+                conn, _, last_used = entry
+                if not self._is_healthy(conn, last_used):
+                    self._discard(conn)
+                    conn = self._connect()
+            else:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def putconn(self, conn, broken=False):
+        if not broken and not conn.closed:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            created = self._created.get(id(conn), 0.0)
+            expired = time.monotonic() - created > self.max_lifetime
+
+            if broken or conn.closed or expired or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, created, time.monotonic()))
+
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": len(self._idle) + self._in_use,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "wait_count": self._wait_count,
+                "wait_time": self._wait_time,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn, _, _ in self._idle:
+                self._discard(conn)
+            self._idle = list()
+            self._cond.notify_all()
+
+
+_pool_lock = threading.Lock()
+
+SAFE_METHODS = ("GET", "HEAD")
+STICKY_COOKIE = "db_sticky"
+REPLICA_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END;"
+)
+
+
+def make_pool(db_config, **connect_kwargs):
+    return ConnectionPool(
+        dict(
             host=db_config["HOST"],
             user=db_config["USER"],
             password=db_config["PASSWORD"],
             port=db_config["PORT"],
-        )
+            **connect_kwargs,
+        ),
+        min_size=db_config.get("POOL_MIN_SIZE", 1),
+        max_size=db_config.get("POOL_MAX_SIZE", 10),
+        timeout=db_config.get("POOL_TIMEOUT", 30.0),
+        max_idle=db_config.get("POOL_MAX_IDLE", 300.0),
+        max_lifetime=db_config.get("POOL_MAX_LIFETIME", 3600.0),
+        check_interval=db_config.get("POOL_CHECK_INTERVAL", 30.0),
+    )
+
+
+def get_pool(app=None):
+    app = app or current_app._get_current_object()
+    pool = app.extensions.get("db_pool")
+
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get("db_pool")
+            if pool is None:
+                pool = make_pool(app.config["DATABASE"])
+                app.extensions["db_pool"] = pool
+
+    return pool
+
+
+class Replica:
+    """A read-only standby and what we last learned about its lag."""
+
+    def __init__(self, pool, max_lag=5.0, check_interval=1.0, retry=30.0):
+        self.pool = pool
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry = retry
+
+        self._lock = threading.Lock()
+        self._lag = None
+        self._checked = None
+        self._down_until = 0.0
+
+    def mark_down(self):
+        self._down_until = time.monotonic() + self.retry
+        self._lag = None
+
+    def _measure_lag(self):
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(REPLICA_LAG_SQL)
+                lag = cur.fetchone()[0]
+            conn.rollback()
+        except psycopg2.Error:
+            self.pool.putconn(conn, broken=True)
+            raise
+        self.pool.putconn(conn)
+
+        return None if lag is None else float(lag)
+
+    def is_usable(self):
+        now = time.monotonic()
+        if now < self._down_until:
+            return False
+
+        # One request re-measures the lag; the others use the last value.
+        if self._lock.acquire(blocking=False):
+            try:
+                if (
+                    self._checked is None
+                    or now - self._checked >= self.check_interval
+                ):
+                    self._checked = now
+                    self._lag = self._measure_lag()
+            except (psycopg2.Error, PoolError):
+                self.mark_down()
+            finally:
+                self._lock.release()
+
+        return self._lag is not None and self._lag <= self.max_lag
+
+
+def get_replicas(app=None):
+    app = app or current_app._get_current_object()
+    replicas = app.extensions.get("db_replicas")
+
+    if replicas is None:
+        with _pool_lock:
+            replicas = app.extensions.get("db_replicas")
+            if replicas is None:
+                db_config = app.config["DATABASE"]
+                replicas = list()
+                for replica_config in db_config.get("REPLICAS", ()):
+                    if isinstance(replica_config, str):
+                        replica_config = {"HOST": replica_config}
+                    # A replica that stops answering must fail fast; the
+                    # request falls back to the primary instead of hanging.
+                    settings = dict(
+                        db_config,
+                        POOL_TIMEOUT=db_config.get(
+                            "REPLICA_POOL_TIMEOUT", 1.0
+                        ),
+                    )
+                    settings.update(replica_config)
+                    replicas.append(
+                        Replica(
+                            make_pool(
+                                settings,
+                                connect_timeout=db_config.get(
+                                    "REPLICA_CONNECT_TIMEOUT", 2
+                                ),
+                                options="-c default_transaction_read_only=on",
+                            ),
+                            max_lag=db_config.get("REPLICA_MAX_LAG", 5.0),
+                            check_interval=db_config.get(
+                                "REPLICA_CHECK_INTERVAL", 1.0
+                            ),
+                            retry=db_config.get("REPLICA_RETRY", 30.0),
+                        )
+                    )
+                app.extensions["db_replicas"] = replicas
+
+    return replicas
+
+
+def is_sticky():
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pick_replica():
+    """Return a replica for this request, or None to use the primary.
+
+    Only GET and HEAD requests read from replicas, and not for a while
+    after the same client wrote something, so it sees its own writes.
+    Anything outside a request (CLI commands, threads) uses the primary.
+    """
+    if not has_request_context() or request.method not in SAFE_METHODS:
+        return None
+    if g.get("use_primary"):
+        return None
+
+    replicas = get_replicas()
+    if not replicas or is_sticky():
+        return None
+
+    for replica in random.sample(replicas, len(replicas)):
+        if replica.is_usable():
+            return replica
+
+    return None
+
+
+def use_primary():
+    """Read from the primary for the rest of this request.
+
+    Call this before loading data into a shared cache. A lagging replica
+    would otherwise store stale rows under a generation or stamp that a
+    write has just bumped, where they stay until the next write.
+    """
+    g.use_primary = True
+
+    pool = g.get("conn_pool")
+    if pool is not None and pool is not get_pool():
+        close_cur()
+        pool.putconn(g.pop("conn"))
+        g.pop("conn_pool")
+
+
+def get_pool_stats():
+    return get_pool().stats()
+
+
+def get_conn():
+    if "conn" not in g:
+        replica = pick_replica()
+        if replica is not None:
+            try:
+                g.conn = replica.pool.getconn()
+                g.conn_pool = replica.pool
+            except (psycopg2.OperationalError, PoolError):
+                replica.mark_down()
+
+        if "conn" not in g:
+            g.conn = get_pool().getconn()
+            g.conn_pool = get_pool()
 
     return g.conn
 
 
 def get_cur():
     if "cur" not in g:
-        g.cur = get_conn().cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor_factory = current_app.extensions.get(
+            "cursor_factory", psycopg2.extras.DictCursor
+        )
+        g.cur = get_conn().cursor(cursor_factory=cursor_factory)
 
     return g.cur
 
@@ -36,7 +402,24 @@ def close_conn(e=None):
     conn = g.pop("conn", None)
 
     if conn is not None:
-        conn.close()
+        broken = isinstance(e, psycopg2.OperationalError)
+        g.pop("conn_pool", get_pool()).putconn(conn, broken=broken)
+
+
+def mark_sticky(response):
+    if request.method not in SAFE_METHODS:
+        sticky_for = current_app.config["DATABASE"].get(
+            "REPLICA_STICKY_SECONDS", 10
+        )
+        response.set_cookie(
+            STICKY_COOKIE,
+            str(int(time.time() + sticky_for)),
+            max_age=sticky_for,
+            httponly=True,
+            samesite="Lax",
+        )
+
+    return response
 
 
 def init_db():
@@ -47,6 +430,8 @@ def init_db():
         cur.execute(sql_fh.read().decode("utf8"))
         conn.commit()
 
+    mark_all_applied()
+
 
 @click.command("init-db")
 @with_appcontext
@@ -56,6 +441,166 @@ def init_db_command():
     click.echo("Initialized the database.")
 
 
+MIGRATION_RE = re.compile(r"^(\d+)_(\w+)\.sql$")
+NO_TRANSACTION = "-- no-transaction"
+LOCK_ID = 5176_0001
+
+
+def get_migrations():
+    migrations_dir = os.path.join(current_app.root_path, "migrations")
+    migrations = list()
+
+    for file_name in sorted(os.listdir(migrations_dir)):
+        match = MIGRATION_RE.match(file_name)
+        if match is None:
+            continue
+
+        with open(os.path.join(migrations_dir, file_name), "r") as sql_fh:
+            sql = sql_fh.read()
+
+        migrations.append((int(match.group(1)), match.group(2), sql))
+
+    return migrations
+
+
+def ensure_migrations_table():
+    cur = get_cur()
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(200) NOT NULL, "
+        "applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);"
+    )
+    get_conn().commit()
+
+
+def get_applied():
+    ensure_migrations_table()
+    cur = get_cur()
+    cur.execute("SELECT version, applied FROM schema_migrations;")
+    applied = {row["version"]: row["applied"] for row in cur.fetchall()}
+    get_conn().commit()
+
+    return applied
+
+
+def mark_all_applied():
+    ensure_migrations_table()
+    cur = get_cur()
+    for version, name, _ in get_migrations():
+        cur.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s) "
+            "ON CONFLICT (version) DO NOTHING;",
+            (version, name),
+        )
+    get_conn().commit()
+
+
+def split_statements(sql):
+    return [
+        statement.strip()
+        for statement in re.split(r";\s*$", sql, flags=re.MULTILINE)
+        if statement.strip()
+        and not all(
+            line.strip().startswith("--") or not line.strip()
+            for line in statement.splitlines()
+        )
+    ]
+
+
+def apply_migration(version, name, sql):
+    conn = get_conn()
+    cur = get_cur()
+
+    if sql.startswith(NO_TRANSACTION):
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block,
+        # so every statement is sent on its own in autocommit mode. A
+        # failed build leaves an INVALID index behind, which is why these
+        # migrations drop each index before creating it rather than use
+        # IF NOT EXISTS, which would keep the broken one on a retry.
+        conn.autocommit = True
+        try:
+            for statement in split_statements(sql):
+                cur.execute(statement)
+        finally:
+            conn.autocommit = False
+        cur.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+            (version, name),
+        )
+        conn.commit()
+    else:
+        try:
+            cur.execute(sql)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name) "
+                "VALUES (%s, %s);",
+                (version, name),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def upgrade():
+    conn = get_conn()
+    cur = get_cur()
+
+    conn.autocommit = True
+    try:
+        cur.execute("SELECT pg_advisory_lock(%s);", (LOCK_ID,))
+    finally:
+        conn.autocommit = False
+
+    done = list()
+    try:
+        # Read what is applied only once we hold the lock, so a concurrent
+        # run that just finished is not repeated.
+        applied = get_applied()
+        for version, name, sql in get_migrations():
+            if version in applied:
+                continue
+            apply_migration(version, name, sql)
+            done.append((version, name))
+    finally:
+        conn.autocommit = True
+        try:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (LOCK_ID,))
+        finally:
+            conn.autocommit = False
+
+    return done
+
+
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    done = upgrade()
+    for version, name in done:
+        click.echo(f"Applied {version:04d}_{name}.")
+    if not done:
+        click.echo("The database is up to date.")
+
+
+@click.command("db-status")
+@with_appcontext
+def db_status_command():
+    """Show which schema migrations have been applied."""
+    applied = get_applied()
+    for version, name, _ in get_migrations():
+        if version in applied:
+            status = applied[version].strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            status = "pending"
+        click.echo(f"{version:04d}_{name}: {status}")
+
+
 def init_app(app):
     app.teardown_appcontext(close_conn)
+    if app.config["DATABASE"].get("REPLICAS"):
+        app.after_request(mark_sticky)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(db_status_command)
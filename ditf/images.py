@@ -0,0 +1,262 @@
+import atexit, os, threading
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+import psycopg2.extras
+
+from .db import get_conn, get_cur, get_pool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it originals are served.
+    Image = None
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+
+def get_images_config(app=None):
+    return (app or current_app).config.get("IMAGES", {})
+
+
+def is_enabled(app=None):
+    return Image is not None and get_images_config(app).get("ENABLED", True)
+
+
+def get_variant_widths(app=None):
+    return tuple(get_images_config(app).get("WIDTHS", (320, 640, 1280)))
+
+
+def get_variant_dir(app=None):
+    return os.path.join((app or current_app).instance_path, "variants")
+
+
+def is_image(file_name):
+    return os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def make_variants(source_path, output_dir, widths, formats, quality):
+    """Write resized copies of an image; runs in a worker process.
+
+    Only widths narrower than the original are produced. Returns a list of
+    ``(width, format, path, size)``.
+    """
+    variants = list()
+
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        os.makedirs(output_dir, exist_ok=True)
+
+        for width in sorted(widths):
+            if width >= image.width:
+                break
+
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+
+            for format_name in formats:
+                pil_format = FORMATS[format_name]
+                if pil_format == "JPEG" and resized.mode != "RGB":
+                    converted = resized.convert("RGB")
+                elif resized.mode not in ("RGB", "RGBA"):
+                    converted = resized.convert("RGBA")
+                else:
+                    converted = resized
+
+                path = os.path.join(output_dir, f"{width}.{format_name}")
+                converted.save(
+                    path + ".part", pil_format, quality=quality, optimize=True
+                )
+                os.replace(path + ".part", path)
+                variants.append(
+                    (width, format_name, path, os.path.getsize(path))
+                )
+
+    return variants
+
+
+class ImagePipeline:
+    def __init__(self, app, workers=2):
+        self.app = app
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+        atexit.register(self.close)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ProcessPoolExecutor(self.workers)
+
+            return self._executor
+
+    def submit(self, file_id, file_path, output_dir):
+        images_config = get_images_config(self.app)
+        future = self._get_executor().submit(
+            make_variants,
+            file_path,
+            output_dir,
+            get_variant_widths(self.app),
+            tuple(images_config.get("FORMATS", ("webp", "jpeg"))),
+            images_config.get("QUALITY", 80),
+        )
+        future.add_done_callback(
+            lambda future: self._record(file_id, file_path, future)
+        )
+
+        return future
+
+    def _record(self, file_id, file_path, future):
+        try:
+            variants = future.result()
+        except Exception:
+            self.app.logger.exception(
+                "Failed to make image variants for file %s.", file_id
+            )
+            return
+
+        if variants:
+            record_variants(get_pool(self.app), file_id, file_path, variants)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def record_variants(pool, file_id, file_path, variants):
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            # The join drops results for a file that was re-uploaded while
+            # its old content was still being resized.
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO file_variants "
+                "(file_id, width, format, file_path, size) "
+                "SELECT v.file_id, v.width, v.format, v.file_path, v.size "
+                "FROM (VALUES %s) "
+                "AS v(file_id, width, format, file_path, size, source) "
+                "JOIN files f ON f.id = v.file_id AND f.file_path = v.source "
+                "ON CONFLICT (file_id, width, format) DO UPDATE SET "
+                "file_path = EXCLUDED.file_path, size = EXCLUDED.size;",
+                [
+                    (file_id, width, format_name, path, size, file_path)
+                    for width, format_name, path, size in variants
+                ],
+            )
+        conn.commit()
+    except Exception:
+        pool.putconn(conn, broken=True)
+        raise
+
+    pool.putconn(conn)
+
+
+def get_output_dir(file_id, blob_hash=None, app=None):
+    name = blob_hash or f"file-{file_id}"
+    return os.path.join(get_variant_dir(app), name[:2], name)
+
+
+def schedule_variants(file_ids):
+    """Queue variant generation for the image attachments among file_ids.
+
+    Call this after the transaction that added the files is committed.
+    """
+    if not file_ids or not is_enabled():
+        return list()
+
+    cur = get_cur()
+    cur.execute(
+        "SELECT id, file_name, file_path, blob_hash FROM files "
+        "WHERE id = ANY(%s) ORDER BY id;",
+        (list(file_ids),),
+    )
+    pipeline = current_app.extensions["image_pipeline"]
+
+    return [
+        pipeline.submit(
+            file_record["id"],
+            file_record["file_path"],
+            get_output_dir(file_record["id"], file_record["blob_hash"]),
+        )
+        for file_record in cur.fetchall()
+        if is_image(file_record["file_name"])
+    ]
+
+
+def get_variants(cur, file_id):
+    cur.execute(
+        "SELECT width, format, file_path, size FROM file_variants "
+        "WHERE file_id = %s ORDER BY width, format;",
+        (file_id,),
+    )
+
+    return [tuple(row) for row in cur.fetchall()]
+
+
+def pick_variant(variants, width, formats):
+    """Return the narrowest variant at least ``width`` wide, or None.
+
+    ``formats`` lists acceptable formats in order of preference. None
+    means the original is the best fit.
+    """
+    for format_name in formats:
+        for variant in variants:
+            if variant[1] == format_name and variant[0] >= width:
+                return variant
+
+    return None
+
+
+def backfill(batch_size=100, missing_only=True):
+    conn = get_conn()
+    cur = get_cur()
+    sql = "SELECT f.id FROM files f"
+    if missing_only:
+        sql += (
+            " WHERE NOT EXISTS "
+            "(SELECT 1 FROM file_variants v WHERE v.file_id = f.id)"
+        )
+    cur.execute(sql + " ORDER BY f.id;")
+    file_ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+
+    futures = list()
+    for start in range(0, len(file_ids), batch_size):
+        batch = schedule_variants(file_ids[start : start + batch_size])
+        for future in batch:
+            future.exception()
+        futures.extend(batch)
+
+    # Shutting the pool down waits for the last results to be recorded.
+    current_app.extensions["image_pipeline"].close()
+
+    return len(futures), sum(future.exception() is None for future in futures)
+
+
+@click.command("image-variants")
+@click.option("--all", "all_files", is_flag=True, help="Redo every image.")
+@click.option("--batch-size", default=100, show_default=True)
+@with_appcontext
+def image_variants_command(all_files, batch_size):
+    """Generate resized variants for existing image attachments."""
+    if not is_enabled():
+        raise click.ClickException("Pillow is not installed.")
+
+    total, done = backfill(batch_size, missing_only=not all_files)
+    click.echo(f"Processed {done} of {total} images.")
+
+
+def init_app(app):
+    app.extensions["image_pipeline"] = ImagePipeline(
+        app, workers=get_images_config(app).get("WORKERS", 2)
+    )
+    app.cli.add_command(image_variants_command)
@@ -0,0 +1,129 @@
+import re, time
+
+from flask import (
+    before_render_template,
+    current_app,
+    g,
+    has_app_context,
+    request,
+    template_rendered,
+)
+import psycopg2.extras
+
+PLACEHOLDER_RE = re.compile(r"%(?:\(\w+\))?s")
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+ROWS_RE = re.compile(r"\((\?(?:, ?\?)*)\)(?:, ?\(\1\))+")
+ARRAY_RE = re.compile(r"ARRAY\[[^\]]*\]")
+SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """Turn a statement into a stable shape for grouping in logs."""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+
+    sql = PLACEHOLDER_RE.sub("?", sql)
+    sql = STRING_RE.sub("?", sql)
+    sql = NUMBER_RE.sub("?", sql)
+    sql = ARRAY_RE.sub("ARRAY[...]", sql)
+    sql = ROWS_RE.sub(r"(\1), ...", sql)
+
+    return SPACE_RE.sub(" ", sql).strip()
+
+
+def record_timing(name, duration):
+    if not has_app_context():
+        return
+
+    timings = g.get("timings")
+    if timings is not None:
+        entry = timings.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+
+
+def record_query(sql, duration):
+    record_timing("db", duration)
+
+    slow_query_ms = current_app.config["INSTRUMENTATION"].get(
+        "SLOW_QUERY_MS", 100
+    )
+    if duration * 1000 >= slow_query_ms:
+        current_app.logger.warning(
+            "Slow query (%.1f ms): %s", duration * 1000, normalize_sql(sql)
+        )
+
+
+class InstrumentedCursor(psycopg2.extras.DictCursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+
+def start_request():
+    g.timings = dict()
+    g.request_started = time.perf_counter()
+
+
+def start_template(sender, template, context, **extra):
+    g.setdefault("template_started", list()).append(time.perf_counter())
+
+
+def finish_template(sender, template, context, **extra):
+    stack = g.get("template_started")
+    if stack:
+        record_timing("template", time.perf_counter() - stack.pop())
+
+
+def finish_request(response):
+    timings = g.pop("timings", None)
+    started = g.pop("request_started", None)
+    if timings is None or started is None:
+        return response
+
+    total = time.perf_counter() - started
+    instrumentation_config = current_app.config["INSTRUMENTATION"]
+
+    if instrumentation_config.get("SERVER_TIMING", True):
+        metrics = [
+            f'{name};dur={duration * 1000:.1f};desc="{count}"'
+            for name, (count, duration) in sorted(timings.items())
+        ]
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(metrics)
+
+    if total * 1000 >= instrumentation_config.get("SLOW_REQUEST_MS", 500):
+        count, duration = timings.get("db", (0, 0.0))
+        current_app.logger.warning(
+            "Slow request %s %s (%.1f ms, %d queries in %.1f ms)",
+            request.method,
+            request.full_path,
+            total * 1000,
+            count,
+            duration * 1000,
+        )
+
+    return response
+
+
+def init_app(app):
+    instrumentation_config = app.config.setdefault("INSTRUMENTATION", {})
+    if not instrumentation_config.get("ENABLED", False):
+        return
+
+    app.extensions["cursor_factory"] = InstrumentedCursor
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    before_render_template.connect(start_template, app)
+    template_rendered.connect(finish_template, app)
@@ -0,0 +1,6 @@
+-- Columns added after the original schema. Run `flask render-markdown`
+-- and `flask reindex-search` once this migration has been applied.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS about_html TEXT NOT NULL DEFAULT '';
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS body_html TEXT NOT NULL DEFAULT '';
+ALTER TABLE posts
+  ADD COLUMN IF NOT EXISTS search_vector TSVECTOR NOT NULL DEFAULT '';
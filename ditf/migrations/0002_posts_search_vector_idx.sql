@@ -0,0 +1,4 @@
+-- no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS posts_search_vector_idx;
+CREATE INDEX CONCURRENTLY posts_search_vector_idx
+  ON posts USING GIN (search_vector);
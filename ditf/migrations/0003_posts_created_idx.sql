@@ -0,0 +1,4 @@
+-- no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS posts_created_id_idx;
+CREATE INDEX CONCURRENTLY posts_created_id_idx
+  ON posts (created, id);
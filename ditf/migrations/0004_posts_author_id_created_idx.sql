@@ -0,0 +1,4 @@
+-- no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS posts_author_id_created_id_idx;
+CREATE INDEX CONCURRENTLY posts_author_id_created_id_idx
+  ON posts (author_id, created, id);
@@ -0,0 +1,7 @@
+-- no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS comments_post_id_created_idx;
+CREATE INDEX CONCURRENTLY comments_post_id_created_idx
+  ON comments (post_id, created);
+DROP INDEX CONCURRENTLY IF EXISTS comments_modified_id_idx;
+CREATE INDEX CONCURRENTLY comments_modified_id_idx
+  ON comments (modified, id);
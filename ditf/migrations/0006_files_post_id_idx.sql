@@ -0,0 +1,3 @@
+-- no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS files_post_id_idx;
+CREATE INDEX CONCURRENTLY files_post_id_idx ON files (post_id);
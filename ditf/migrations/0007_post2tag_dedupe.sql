@@ -0,0 +1,3 @@
+-- Drop duplicate (post_id, tag_id) rows so the primary key can be built.
+DELETE FROM post2tag a USING post2tag b
+  WHERE a.ctid > b.ctid AND a.post_id = b.post_id AND a.tag_id = b.tag_id;
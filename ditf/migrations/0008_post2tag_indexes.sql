@@ -0,0 +1,7 @@
+-- no-transaction
+DROP INDEX CONCURRENTLY IF EXISTS post2tag_pkey;
+CREATE UNIQUE INDEX CONCURRENTLY post2tag_pkey
+  ON post2tag (post_id, tag_id);
+DROP INDEX CONCURRENTLY IF EXISTS post2tag_tag_id_post_id_idx;
+CREATE INDEX CONCURRENTLY post2tag_tag_id_post_id_idx
+  ON post2tag (tag_id, post_id);
@@ -0,0 +1,10 @@
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint WHERE conname = 'post2tag_pkey'
+  ) THEN
+    ALTER TABLE post2tag
+      ADD CONSTRAINT post2tag_pkey PRIMARY KEY USING INDEX post2tag_pkey;
+  END IF;
+END
+$$;
@@ -0,0 +1,20 @@
+ALTER TABLE tags ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION post2tag_post_count() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE tags SET post_count = post_count + 1 WHERE id = NEW.tag_id;
+  ELSE
+    UPDATE tags SET post_count = post_count - 1 WHERE id = OLD.tag_id;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS post2tag_post_count ON post2tag;
+CREATE TRIGGER post2tag_post_count AFTER INSERT OR DELETE ON post2tag
+  FOR EACH ROW EXECUTE FUNCTION post2tag_post_count();
+
+UPDATE tags t SET post_count = (
+  SELECT COUNT(*) FROM post2tag pt WHERE pt.tag_id = t.id
+);
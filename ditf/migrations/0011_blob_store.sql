@@ -0,0 +1,43 @@
+CREATE TABLE IF NOT EXISTS blobs (
+  hash CHAR(64) PRIMARY KEY,
+  size BIGINT NOT NULL,
+  ref_count INTEGER NOT NULL DEFAULT 0,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE files ADD COLUMN IF NOT EXISTS file_name VARCHAR(255);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS blob_hash CHAR(64);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS size BIGINT;
+
+UPDATE files SET file_name = substring(file_path FROM '[^/]+$')
+  WHERE file_name IS NULL;
+
+-- Re-uploads used to add a row per upload; the newest one is the one the
+-- rendered Markdown links to, so keep that.
+DELETE FROM files f USING files newer
+  WHERE newer.post_id = f.post_id AND newer.file_name = f.file_name
+  AND newer.id > f.id;
+
+ALTER TABLE files ALTER COLUMN file_name SET NOT NULL;
+ALTER TABLE files DROP CONSTRAINT IF EXISTS files_post_id_file_name_key;
+ALTER TABLE files ADD CONSTRAINT files_post_id_file_name_key
+  UNIQUE (post_id, file_name);
+
+CREATE OR REPLACE FUNCTION files_blob_ref_count() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blob_hash IS NOT NULL THEN
+    UPDATE blobs SET ref_count = ref_count - 1 WHERE hash = OLD.blob_hash;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blob_hash IS NOT NULL THEN
+    INSERT INTO blobs (hash, size, ref_count)
+      VALUES (NEW.blob_hash, NEW.size, 1)
+      ON CONFLICT (hash) DO UPDATE SET ref_count = blobs.ref_count + 1;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS files_blob_ref_count ON files;
+CREATE TRIGGER files_blob_ref_count
+  AFTER INSERT OR DELETE OR UPDATE OF blob_hash ON files
+  FOR EACH ROW EXECUTE FUNCTION files_blob_ref_count();
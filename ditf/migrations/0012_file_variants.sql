@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS file_variants (
+  id SERIAL PRIMARY KEY,
+  file_id INTEGER NOT NULL,
+  width INTEGER NOT NULL,
+  format VARCHAR(10) NOT NULL,
+  file_path VARCHAR(1000) NOT NULL,
+  size BIGINT NOT NULL,
+  CONSTRAINT file_variants_file_id_width_format_key
+    UNIQUE (file_id, width, format),
+  FOREIGN KEY (file_id) REFERENCES files (id) ON DELETE CASCADE
+);
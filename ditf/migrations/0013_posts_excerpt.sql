@@ -0,0 +1,3 @@
+-- Run `flask render-markdown` once this migration has been applied to
+-- fill in the excerpts.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS excerpt TEXT NOT NULL DEFAULT '';
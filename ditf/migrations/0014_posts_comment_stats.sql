@@ -0,0 +1,32 @@
+ALTER TABLE posts
+  ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS comments_changed TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION comments_post_stats() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE posts SET comment_count = comment_count + 1,
+      comments_changed = CURRENT_TIMESTAMP
+      WHERE id = NEW.post_id;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE posts SET comment_count = comment_count - 1,
+      comments_changed = CURRENT_TIMESTAMP
+      WHERE id = OLD.post_id;
+  ELSE
+    UPDATE posts SET comments_changed = CURRENT_TIMESTAMP
+      WHERE id = NEW.post_id;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS comments_post_stats ON comments;
+CREATE TRIGGER comments_post_stats AFTER INSERT OR UPDATE OR DELETE
+  ON comments FOR EACH ROW EXECUTE FUNCTION comments_post_stats();
+
+UPDATE posts p SET comment_count = c.n, comments_changed = c.modified
+  FROM (
+    SELECT post_id, COUNT(*) AS n, MAX(modified) AS modified
+    FROM comments GROUP BY post_id
+  ) c
+  WHERE p.id = c.post_id;
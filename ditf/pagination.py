@@ -0,0 +1,153 @@
+from datetime import datetime
+
+from flask import current_app, request
+from flask_paginate import Pagination
+
+from .cache import TTLCache
+from .db import get_cur, use_primary
+
+_totals = TTLCache(maxsize=1024, ttl=60.0)
+
+
+class KeysetPagination(Pagination):
+    def __init__(self, prev_cursor=None, next_cursor=None, **kwargs):
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        super().__init__(**kwargs)
+
+    def page_href(self, page):
+        self.args.pop("after", None)
+        self.args.pop("before", None)
+
+        if page == self.page + 1 and self.next_cursor:
+            self.args["after"] = self.next_cursor
+        elif page == self.page - 1 and self.prev_cursor:
+            self.args["before"] = self.prev_cursor
+
+        return super().page_href(page)
+
+
+def encode_cursor(values):
+    return ",".join(
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in values
+    )
+
+
+def decode_cursor(cursor, types):
+    parts = cursor.split(",")
+    if len(parts) != len(types):
+        return None
+
+    try:
+        return [
+            datetime.fromisoformat(part) if type_ is datetime else type_(part)
+            for part, type_ in zip(parts, types)
+        ]
+    except ValueError:
+        return None
+
+
+def get_cursor(types):
+    for direction in ("after", "before"):
+        cursor = request.args.get(direction)
+        if cursor:
+            values = decode_cursor(cursor, types)
+            if values is not None:
+                return direction, values
+
+    return None, None
+
+
+def fetch_page(select, where, params, keys, page, per_page, offset):
+    """Fetch one page ordered by ``keys`` descending.
+
+    ``keys`` is a sequence of ``(expression, column, type)`` triples.
+    When the request carries an ``after``/``before`` cursor the page is
+    found by seeking on the key columns, so its cost does not depend on
+    how deep it is; otherwise the query falls back to OFFSET.
+    """
+    direction, values = get_cursor([type_ for _, _, type_ in keys])
+    conditions = list(where)
+    args = list(params)
+    key_sql = "(" + ", ".join(expr for expr, _, _ in keys) + ")"
+    placeholders = "(" + ", ".join("%s" for _ in keys) + ")"
+    order = "DESC"
+
+    if direction == "after":
+        conditions.append(f"{key_sql} < {placeholders}")
+        args.extend(values)
+    elif direction == "before":
+        conditions.append(f"{key_sql} > {placeholders}")
+        args.extend(values)
+        order = "ASC"
+
+    sql = select
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(f"{expr} {order}" for expr, _, _ in keys)
+    sql += " LIMIT %s"
+    args.append(per_page)
+    if direction is None:
+        sql += " OFFSET %s"
+        args.append(offset)
+
+    cur = get_cur()
+    cur.execute(sql + ";", args)
+    rows = cur.fetchall()
+    if direction == "before":
+        rows.reverse()
+
+    prev_cursor = next_cursor = None
+    if rows:
+        if page > 1:
+            prev_cursor = encode_cursor([rows[0][col] for _, col, _ in keys])
+        next_cursor = encode_cursor([rows[-1][col] for _, col, _ in keys])
+
+    return rows, prev_cursor, next_cursor
+
+
+def estimate_count(table):
+    cur = get_cur()
+    cur.execute(
+        "SELECT reltuples::BIGINT FROM pg_class WHERE oid = %s::regclass;",
+        (table,),
+    )
+    row = cur.fetchone()
+
+    return row[0] if row else -1
+
+
+def get_total(key, sql, params=(), estimate_table=None):
+    """Return a row count for a listing, cached per worker.
+
+    Unfiltered listings pass ``estimate_table`` and read the planner's
+    estimate once the table is larger than ``ESTIMATE_THRESHOLD`` rows;
+    everything else runs ``sql`` and caches the exact count.
+    """
+    total = _totals.get(key)
+    if total is not None:
+        return total
+
+    use_primary()
+    pagination_config = current_app.config.get("PAGINATION", {})
+    _totals.ttl = pagination_config.get("COUNT_TTL", 60.0)
+
+    if estimate_table is not None:
+        threshold = pagination_config.get("ESTIMATE_THRESHOLD", 10000)
+        estimate = estimate_count(estimate_table)
+        if estimate >= threshold:
+            total = estimate
+
+    if total is None:
+        cur = get_cur()
+        cur.execute(sql, params)
+        total = cur.fetchone()[0]
+
+    _totals.set(key, total)
+
+    return total
+
+
+def invalidate_totals():
+    _totals.clear()
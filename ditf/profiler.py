@@ -0,0 +1,229 @@
+import atexit, collections, json, os, random, sys, threading, time
+
+from flask import current_app, g, request
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "rate": 100,
+    "endpoint": "",
+    "interval": 0.01,
+    "reset": 0,
+}
+MAX_DEPTH = 64
+MAX_SAMPLES = 2000  # per request
+MAX_STACKS = 20000  # per process
+SETTINGS_CHECK_INTERVAL = 1.0
+WRITE_INTERVAL = 2.0
+
+
+def collapse(frame):
+    names = list()
+    while frame is not None and len(names) < MAX_DEPTH:
+        module = frame.f_globals.get("__name__", "?")
+        names.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Sampling profiler for selected requests.
+
+    Settings live in ``instance/profiler/settings.json`` so every worker
+    follows the admin page. Each process keeps its stacks in memory and
+    writes them to ``stacks-<pid>.txt`` in collapsed-stack format.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.profile_dir = os.path.join(app.instance_path, "profiler")
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._active = dict()  # thread ident -> [sample count, Counter]
+        self._stacks = collections.Counter()
+        self._settings = dict(DEFAULT_SETTINGS)
+        self._settings_mtime = None
+        self._checked = None
+        self._written = 0.0
+        self._dirty = False
+        self._thread = None
+        self._pid = None
+
+        atexit.register(self.write)
+
+    def get_settings_path(self):
+        return os.path.join(self.profile_dir, "settings.json")
+
+    def get_stacks_path(self):
+        return os.path.join(self.profile_dir, f"stacks-{os.getpid()}.txt")
+
+    def get_settings(self):
+        now = time.monotonic()
+        if (
+            self._checked is not None
+            and now - self._checked < SETTINGS_CHECK_INTERVAL
+        ):
+            return self._settings
+
+        self._checked = now
+        try:
+            mtime = os.stat(self.get_settings_path()).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime != self._settings_mtime:
+            self._settings_mtime = mtime
+            settings = dict(DEFAULT_SETTINGS)
+            if mtime is not None:
+                try:
+                    with open(self.get_settings_path(), "r") as settings_fh:
+                        settings.update(json.load(settings_fh))
+                except (OSError, ValueError):
+                    pass
+
+            if settings["reset"] != self._settings["reset"]:
+                with self._lock:
+                    self._stacks.clear()
+                    self._dirty = False
+            self._settings = settings
+
+        return self._settings
+
+    def save_settings(self, **changes):
+        settings = dict(self.get_settings(), **changes)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        tmp_path = f"{self.get_settings_path()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as settings_fh:
+            json.dump(settings, settings_fh)
+        os.replace(tmp_path, self.get_settings_path())
+        self._checked = None
+
+        return self.get_settings()
+
+    def reset(self):
+        if os.path.isdir(self.profile_dir):
+            for file_name in os.listdir(self.profile_dir):
+                if file_name.startswith("stacks-"):
+                    os.remove(os.path.join(self.profile_dir, file_name))
+        self.save_settings(reset=time.time())
+
+    def should_sample(self, endpoint):
+        settings = self.get_settings()
+        if not settings["enabled"]:
+            return False
+        if settings["endpoint"]:
+            return endpoint == settings["endpoint"]
+
+        return random.random() * max(settings["rate"], 1) < 1
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="profiler", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(max(self._settings["interval"], 0.001))
+
+            with self._lock:
+                if not self._active:
+                    self._wakeup.clear()
+                    continue
+
+                frames = sys._current_frames()
+                for ident, entry in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is None or entry[0] >= MAX_SAMPLES:
+                        continue
+                    entry[0] += 1
+                    entry[1][collapse(frame)] += 1
+
+    def start(self):
+        self._ensure_thread()
+        with self._lock:
+            self._active[threading.get_ident()] = [0, collections.Counter()]
+        self._wakeup.set()
+
+    def stop(self):
+        with self._lock:
+            entry = self._active.pop(threading.get_ident(), None)
+            if entry is None:
+                return
+
+            for stack, count in entry[1].items():
+                if (
+                    stack not in self._stacks
+                    and len(self._stacks) >= MAX_STACKS
+                ):
+                    stack = "[truncated]"
+                self._stacks[stack] += count
+            self._dirty = True
+
+        if time.monotonic() - self._written >= WRITE_INTERVAL:
+            self.write()
+
+    def write(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            lines = [
+                f"{stack} {count}\n" for stack, count in self._stacks.items()
+            ]
+            self._dirty = False
+            self._written = time.monotonic()
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        tmp_path = f"{self.get_stacks_path()}.tmp"
+        with open(tmp_path, "w") as stacks_fh:
+            stacks_fh.writelines(lines)
+        os.replace(tmp_path, self.get_stacks_path())
+
+    def load_stacks(self):
+        """Merge the stacks written by every worker."""
+        self.write()
+        stacks = collections.Counter()
+        if not os.path.isdir(self.profile_dir):
+            return stacks
+
+        for file_name in os.listdir(self.profile_dir):
+            if not file_name.startswith("stacks-"):
+                continue
+            if not file_name.endswith(".txt"):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, file_name)) as fh:
+                    for line in fh:
+                        stack, _, count = line.rstrip("\n").rpartition(" ")
+                        if stack:
+                            stacks[stack] += int(count)
+            except (OSError, ValueError):
+                continue
+
+        return stacks
+
+
+def start_profile():
+    profiler = current_app.extensions["profiler"]
+    if profiler.should_sample(request.endpoint):
+        g.profiling = True
+        profiler.start()
+
+
+def stop_profile(e=None):
+    if g.pop("profiling", False):
+        current_app.extensions["profiler"].stop()
+
+
+def init_app(app):
+    app.extensions["profiler"] = Profiler(app)
+    app.before_request(start_profile)
+    app.teardown_request(stop_profile)
@@ -0,0 +1,180 @@
+import re, time
+
+import click
+from flask.cli import with_appcontext
+from markdown import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from markupsafe import Markup
+import psycopg2.extras
+
+from .db import get_conn, get_cur
+from .images import get_variant_widths, is_enabled, is_image
+from .instrument import record_timing
+
+MARKDOWN_EXTENSIONS = ["nl2br", "tables", "fenced_code"]
+EXCERPT_LENGTH = 200
+VERSION_LENGTH = 12
+
+
+SRC_RE = re.compile(r'src="([^"]*)"')
+
+
+class AttachmentTreeprocessor(Treeprocessor):
+    def __init__(self, md, urls, widths=()):
+        super().__init__(md)
+        self.urls = urls
+        self.widths = widths
+
+    def replace_src(self, match):
+        url = self.urls.get(match.group(1))
+
+        return match.group(0) if url is None else f'src="{url}"'
+
+    def run(self, root):
+        for element in root.iter("img"):
+            name = element.get("src")
+            url = self.urls.get(name)
+            if url is not None:
+                element.set("src", url)
+                if self.widths and is_image(name):
+                    separator = "&" if "?" in url else "?"
+                    element.set(
+                        "srcset",
+                        ", ".join(
+                            f"{url}{separator}w={width} {width}w"
+                            for width in self.widths
+                        ),
+                    )
+
+        # Inline <img> tags are kept aside as raw HTML until the end.
+        stash = self.md.htmlStash
+        stash.rawHtmlBlocks = [
+            SRC_RE.sub(self.replace_src, block)
+            if isinstance(block, str)
+            else block
+            for block in stash.rawHtmlBlocks
+        ]
+
+
+class AttachmentExtension(Extension):
+    def __init__(self, urls, widths=()):
+        super().__init__()
+        self.urls = urls
+        self.widths = widths
+
+    def extendMarkdown(self, md):
+        md.treeprocessors.register(
+            AttachmentTreeprocessor(md, self.urls, self.widths),
+            "attachments",
+            0,
+        )
+
+
+def render_markdown(text, attachments=None):
+    extensions = list(MARKDOWN_EXTENSIONS)
+    if attachments:
+        widths = get_variant_widths() if is_enabled() else ()
+        extensions.append(AttachmentExtension(attachments, widths))
+
+    started = time.perf_counter()
+    html = markdown(text, extensions=extensions)
+    record_timing("markdown", time.perf_counter() - started)
+
+    return html
+
+
+def get_attachment_urls(cur, post_ids):
+    urls = {post_id: dict() for post_id in post_ids}
+    cur.execute(
+        "SELECT id, post_id, file_name, blob_hash FROM files "
+        "WHERE post_id = ANY(%s) ORDER BY id;",
+        (list(post_ids),),
+    )
+    for file_id, post_id, file_name, blob_hash in cur.fetchall():
+        # Re-uploading a name keeps the file id, so the content hash in the
+        # URL is what lets browsers cache attachments for long.
+        url = f"/{post_id}/{file_id}"
+        if blob_hash:
+            url += f"?v={blob_hash[:VERSION_LENGTH]}"
+        urls[post_id][file_name] = url
+
+    return urls
+
+
+def make_excerpt(html, length=EXCERPT_LENGTH):
+    text = Markup(html).striptags()
+    if len(text) <= length:
+        return text
+
+    return text[:length].rsplit(" ", 1)[0] + "…"
+
+
+def render_post(cur, post_id, body):
+    urls = get_attachment_urls(cur, [post_id])[post_id]
+    body_html = render_markdown(body, urls)
+    cur.execute(
+        "UPDATE posts SET body_html = %s, excerpt = %s WHERE id = %s;",
+        (body_html, make_excerpt(body_html), post_id),
+    )
+
+
+def render_all(batch_size=100):
+    conn = get_conn()
+    cur = get_cur()
+    total = 0
+
+    for table, source, targets in (
+        ("posts", "body", ("body_html", "excerpt")),
+        ("users", "about", ("about_html",)),
+    ):
+        src_cur = conn.cursor(name=f"render_{table}")
+        src_cur.itersize = batch_size
+        src_cur.execute(f"SELECT id, {source} FROM {table} ORDER BY id;")
+
+        while True:
+            rows = src_cur.fetchmany(batch_size)
+            if not rows:
+                break
+
+            if table == "posts":
+                urls = get_attachment_urls(cur, [row[0] for row in rows])
+            else:
+                urls = dict()
+
+            values = [
+                (row[0], render_markdown(row[1], urls.get(row[0])))
+                for row in rows
+            ]
+            if table == "posts":
+                values = [
+                    (id, html, make_excerpt(html)) for id, html in values
+                ]
+
+            psycopg2.extras.execute_values(
+                cur,
+                f"UPDATE {table} t SET "
+                + ", ".join(f"{target} = v.{target}" for target in targets)
+                + f" FROM (VALUES %s) AS v(id, {', '.join(targets)}) "
+                "WHERE t.id = v.id;",
+                values,
+            )
+            total += len(rows)
+
+        src_cur.close()
+
+    conn.commit()
+
+    return total
+
+
+@click.command("render-markdown")
+@with_appcontext
+def render_markdown_command():
+    """Re-render the cached HTML and excerpts of posts and profiles."""
+    total = render_all()
+    click.echo(f"Rendered {total} documents.")
+
+
+def init_app(app):
+    app.cli.add_command(render_markdown_command)
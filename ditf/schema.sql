@@ -3,12 +3,17 @@ DROP TABLE IF EXISTS posts CASCADE;
 DROP TABLE IF EXISTS comments CASCADE;
 DROP TABLE IF EXISTS tags CASCADE;
 DROP TABLE IF EXISTS post2tag CASCADE;
+DROP TABLE IF EXISTS files CASCADE;
+DROP TABLE IF EXISTS blobs CASCADE;
+DROP TABLE IF EXISTS file_variants CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
 
 CREATE TABLE users (
   id SERIAL PRIMARY KEY,
   username VARCHAR(20) UNIQUE NOT NULL,
   mail VARCHAR(100) UNIQUE NOT NULL,
   about VARCHAR(2000) NOT NULL DEFAULT '',
+  about_html TEXT NOT NULL DEFAULT '',
   password VARCHAR(200) NOT NULL
 );
 
@@ -19,10 +24,19 @@ CREATE TABLE posts (
   modified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   title VARCHAR(100) NOT NULL,
   body TEXT NOT NULL,
+  body_html TEXT NOT NULL DEFAULT '',
+  excerpt TEXT NOT NULL DEFAULT '',
+  search_vector TSVECTOR NOT NULL DEFAULT '',
   views INTEGER NOT NULL,
+  comment_count INTEGER NOT NULL DEFAULT 0,
+  comments_changed TIMESTAMP,
   FOREIGN KEY (author_id) REFERENCES users (id) ON DELETE CASCADE
 );
 
+CREATE INDEX posts_search_vector_idx ON posts USING GIN (search_vector);
+CREATE INDEX posts_created_id_idx ON posts (created, id);
+CREATE INDEX posts_author_id_created_id_idx ON posts (author_id, created, id);
+
 CREATE TABLE comments (
   id SERIAL PRIMARY KEY,
   author_id INTEGER NOT NULL,
@@ -34,21 +48,106 @@ CREATE TABLE comments (
   FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
 );
 
+CREATE INDEX comments_post_id_created_idx ON comments (post_id, created);
+CREATE INDEX comments_modified_id_idx ON comments (modified, id);
+
+CREATE OR REPLACE FUNCTION comments_post_stats() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE posts SET comment_count = comment_count + 1,
+      comments_changed = CURRENT_TIMESTAMP
+      WHERE id = NEW.post_id;
+  ELSIF TG_OP = 'DELETE' THEN
+    UPDATE posts SET comment_count = comment_count - 1,
+      comments_changed = CURRENT_TIMESTAMP
+      WHERE id = OLD.post_id;
+  ELSE
+    UPDATE posts SET comments_changed = CURRENT_TIMESTAMP
+      WHERE id = NEW.post_id;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER comments_post_stats AFTER INSERT OR UPDATE OR DELETE
+  ON comments FOR EACH ROW EXECUTE FUNCTION comments_post_stats();
+
 CREATE TABLE tags (
   id SERIAL PRIMARY KEY,
-  title VARCHAR(50) NOT NULL
+  title VARCHAR(50) NOT NULL,
+  post_count INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE post2tag (
   post_id INTEGER NOT NULL,
   tag_id INTEGER NOT NULL,
+  CONSTRAINT post2tag_pkey PRIMARY KEY (post_id, tag_id),
   FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE,
   FOREIGN KEY (tag_id) REFERENCES tags (id) ON DELETE CASCADE
 );
 
+CREATE INDEX post2tag_tag_id_post_id_idx ON post2tag (tag_id, post_id);
+
+CREATE OR REPLACE FUNCTION post2tag_post_count() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE tags SET post_count = post_count + 1 WHERE id = NEW.tag_id;
+  ELSE
+    UPDATE tags SET post_count = post_count - 1 WHERE id = OLD.tag_id;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER post2tag_post_count AFTER INSERT OR DELETE ON post2tag
+  FOR EACH ROW EXECUTE FUNCTION post2tag_post_count();
+
 CREATE TABLE files (
   id SERIAL PRIMARY KEY,
   post_id INTEGER NOT NULL,
+  file_name VARCHAR(255) NOT NULL,
   file_path VARCHAR(1000) NOT NULL,
+  blob_hash CHAR(64),
+  size BIGINT,
+  CONSTRAINT files_post_id_file_name_key UNIQUE (post_id, file_name),
   FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
 );
+
+CREATE INDEX files_post_id_idx ON files (post_id);
+
+CREATE TABLE file_variants (
+  id SERIAL PRIMARY KEY,
+  file_id INTEGER NOT NULL,
+  width INTEGER NOT NULL,
+  format VARCHAR(10) NOT NULL,
+  file_path VARCHAR(1000) NOT NULL,
+  size BIGINT NOT NULL,
+  CONSTRAINT file_variants_file_id_width_format_key
+    UNIQUE (file_id, width, format),
+  FOREIGN KEY (file_id) REFERENCES files (id) ON DELETE CASCADE
+);
+
+CREATE TABLE blobs (
+  hash CHAR(64) PRIMARY KEY,
+  size BIGINT NOT NULL,
+  ref_count INTEGER NOT NULL DEFAULT 0,
+  created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION files_blob_ref_count() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blob_hash IS NOT NULL THEN
+    UPDATE blobs SET ref_count = ref_count - 1 WHERE hash = OLD.blob_hash;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blob_hash IS NOT NULL THEN
+    INSERT INTO blobs (hash, size, ref_count)
+      VALUES (NEW.blob_hash, NEW.size, 1)
+      ON CONFLICT (hash) DO UPDATE SET ref_count = blobs.ref_count + 1;
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER files_blob_ref_count
+  AFTER INSERT OR DELETE OR UPDATE OF blob_hash ON files
+  FOR EACH ROW EXECUTE FUNCTION files_blob_ref_count();
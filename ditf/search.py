@@ -0,0 +1,96 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+
+from .db import get_conn, get_cur
+
+SNIPPET_START = "\x02"
+SNIPPET_STOP = "\x03"
+SNIPPET_OPTIONS = (
+    f"StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, "
+    "MaxWords=35, MinWords=15, MaxFragments=2"
+)
+# Every lexeme of the websearch query becomes a prefix match, so that with
+# the default 'simple' configuration 블로그 still finds 블로그를 and other
+# words with Korean particles attached, as the old LIKE search did.
+PREFIX_QUERY = (
+    "CAST(regexp_replace("
+    "websearch_to_tsquery(%(config)s::regconfig, %(query)s)::text, "
+    r"'(''(?:[^'']|'''')*'')', '\1:*', 'g') AS tsquery)"
+)
+
+
+def get_search_config():
+    return current_app.config.get("SEARCH", {}).get("CONFIG", "simple")
+
+
+def update_search_vector(cur, post_id=None):
+    where = "" if post_id is None else "WHERE id = %(post_id)s"
+    cur.execute(
+        "UPDATE posts SET search_vector = "
+        "setweight(to_tsvector(%(config)s::regconfig, title), 'A') || "
+        "setweight(to_tsvector(%(config)s::regconfig, body), 'B') "
+        f"{where};",
+        {"config": get_search_config(), "post_id": post_id},
+    )
+
+
+def make_snippet(headline):
+    return (
+        escape(headline)
+        .replace(SNIPPET_START, Markup("<mark>"))
+        .replace(SNIPPET_STOP, Markup("</mark>"))
+    )
+
+
+def search_posts(query, limit, offset):
+    cur = get_cur()
+    params = {
+        "config": get_search_config(),
+        "query": query,
+        "options": SNIPPET_OPTIONS,
+        "limit": limit,
+        "offset": offset,
+    }
+
+    cur.execute(
+        "SELECT COUNT(*) FROM posts "
+        f"WHERE search_vector @@ {PREFIX_QUERY};",
+        params,
+    )
+    total = cur.fetchone()[0]
+
+    cur.execute(
+        "SELECT r.id, title, created, modified, author_id, views, username, "
+        "comment_count, "
+        "ts_headline(%(config)s::regconfig, body, q, %(options)s) AS snippet "
+        "FROM ("
+        "SELECT p.id, title, body, created, modified, author_id, views, "
+        "comment_count, username, ts_rank_cd(search_vector, q) AS rank, q "
+        "FROM posts p JOIN users u ON p.author_id = u.id, "
+        f"{PREFIX_QUERY} q "
+        "WHERE search_vector @@ q "
+        "ORDER BY rank DESC, created DESC LIMIT %(limit)s OFFSET %(offset)s"
+        ") r ORDER BY rank DESC, created DESC;",
+        params,
+    )
+    posts = cur.fetchall()
+
+    for post in posts:
+        post["snippet"] = make_snippet(post["snippet"])
+
+    return total, posts
+
+
+@click.command("reindex-search")
+@with_appcontext
+def reindex_search_command():
+    """Rebuild the full-text search vector of every post."""
+    update_search_vector(get_cur())
+    get_conn().commit()
+    click.echo("Rebuilt the search index.")
+
+
+def init_app(app):
+    app.cli.add_command(reindex_search_command)
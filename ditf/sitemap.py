@@ -0,0 +1,208 @@
+import os, tempfile, threading, time
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from flask import Blueprint, current_app, send_file
+from werkzeug.exceptions import abort
+import psycopg2.extras
+
+from .db import get_conn, use_primary
+
+BP = Blueprint("sitemap", __name__)
+
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+URLS_PER_SHARD = 50000
+
+_build_lock = threading.Lock()
+
+
+def get_sitemap_dir():
+    sitemap_dir = os.path.join(current_app.instance_path, "sitemap")
+    os.makedirs(sitemap_dir, exist_ok=True)
+
+    return sitemap_dir
+
+
+def read_stamp(path):
+    try:
+        with open(path, "r") as stamp_fh:
+            return stamp_fh.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w", encoding="utf-8") as tmp_fh:
+        tmp_fh.write(data)
+    os.replace(tmp_path, path)
+
+
+def invalidate():
+    write_atomic(
+        os.path.join(get_sitemap_dir(), "stamp"), str(time.time_ns())
+    )
+
+
+def format_lastmod(timestamp):
+    return timestamp.replace(microsecond=0, tzinfo=timezone.utc).isoformat()
+
+
+def format_url(loc, lastmod, priority):
+    return (
+        f"  <url>\n"
+        f"    <loc>{escape(loc)}</loc>\n"
+        f"    <lastmod>{lastmod}</lastmod>\n"
+        f"    <changefreq>daily</changefreq>\n"
+        f"    <priority>{priority}</priority>\n"
+        f"  </url>\n"
+    )
+
+
+class ShardWriter:
+    def __init__(self, sitemap_dir, limit):
+        self.sitemap_dir = sitemap_dir
+        self.limit = limit
+        self.paths = list()
+        self._fh = None
+        self._count = 0
+
+    def _open(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.sitemap_dir)
+        self._fh = os.fdopen(fd, "w", encoding="utf-8")
+        self._fh.write(
+            "<?xml version='1.0' encoding='utf-8'?>\n"
+            f'<urlset xmlns="{SITEMAP_NS}">\n'
+        )
+        self.paths.append(tmp_path)
+        self._count = 0
+
+    def _close(self):
+        self._fh.write("</urlset>\n")
+        self._fh.close()
+        self._fh = None
+
+    def write(self, entry):
+        if self._fh is None:
+            self._open()
+        elif self._count >= self.limit:
+            self._close()
+            self._open()
+
+        self._fh.write(entry)
+        self._count += 1
+
+    def close(self):
+        if self._fh is not None:
+            self._close()
+
+
+def build():
+    """Stream every post into the sitemap files on disk.
+
+    A single ``sitemap.xml`` is written while the archive fits into one
+    shard; beyond that ``sitemap.xml`` becomes a sitemap index that
+    points at ``sitemap-<n>.xml`` shards.
+    """
+    domain = current_app.config["DOMAIN"]
+    sitemap_dir = get_sitemap_dir()
+    stamp = read_stamp(os.path.join(sitemap_dir, "stamp")) or ""
+    built = format_lastmod(datetime.now(timezone.utc))
+
+    writer = ShardWriter(
+        sitemap_dir,
+        current_app.config.get("SITEMAP", {}).get(
+            "URLS_PER_SHARD", URLS_PER_SHARD
+        ),
+    )
+    writer.write(format_url(domain, built, "0.8"))
+
+    use_primary()
+    conn = get_conn()
+    cur = conn.cursor(
+        name="sitemap", cursor_factory=psycopg2.extras.DictCursor
+    )
+    cur.itersize = 2000
+    try:
+        cur.execute("SELECT id, modified FROM posts ORDER BY id;")
+        for post in cur:
+            writer.write(
+                format_url(
+                    f"{domain}{post['id']}",
+                    format_lastmod(post["modified"]),
+                    "0.5",
+                )
+            )
+    finally:
+        cur.close()
+        conn.commit()
+        writer.close()
+
+    if len(writer.paths) == 1:
+        os.replace(writer.paths[0], os.path.join(sitemap_dir, "sitemap.xml"))
+        shard_count = 0
+    else:
+        for number, tmp_path in enumerate(writer.paths, 1):
+            os.replace(
+                tmp_path, os.path.join(sitemap_dir, f"sitemap-{number}.xml")
+            )
+        shard_count = len(writer.paths)
+        write_atomic(
+            os.path.join(sitemap_dir, "sitemap.xml"),
+            "<?xml version='1.0' encoding='utf-8'?>\n"
+            f'<sitemapindex xmlns="{SITEMAP_NS}">\n'
+            + "".join(
+                f"  <sitemap>\n"
+                f"    <loc>{escape(domain)}sitemap-{number}.xml</loc>\n"
+                f"    <lastmod>{built}</lastmod>\n"
+                f"  </sitemap>\n"
+                for number in range(1, shard_count + 1)
+            )
+            + "</sitemapindex>\n",
+        )
+
+    number = shard_count + 1
+    while os.path.exists(os.path.join(sitemap_dir, f"sitemap-{number}.xml")):
+        os.remove(os.path.join(sitemap_dir, f"sitemap-{number}.xml"))
+        number += 1
+
+    write_atomic(os.path.join(sitemap_dir, "built"), stamp)
+
+
+def ensure_built():
+    sitemap_dir = get_sitemap_dir()
+    stamp_path = os.path.join(sitemap_dir, "stamp")
+    built_path = os.path.join(sitemap_dir, "built")
+
+    built = read_stamp(built_path)
+    if built is not None and built == (read_stamp(stamp_path) or ""):
+        return sitemap_dir
+
+    with _build_lock:
+        built = read_stamp(built_path)
+        if built is None or built != (read_stamp(stamp_path) or ""):
+            build()
+
+    return sitemap_dir
+
+
+@BP.route("/sitemap.xml", methods=("GET",))
+def show_sitemap():
+    sitemap_dir = ensure_built()
+
+    return send_file(
+        os.path.join(sitemap_dir, "sitemap.xml"),
+        mimetype="application/xml",
+        max_age=3600,
+    )
+
+
+@BP.route("/sitemap-<int:number>.xml", methods=("GET",))
+def show_sitemap_shard(number):
+    sitemap_dir = ensure_built()
+    shard_path = os.path.join(sitemap_dir, f"sitemap-{number}.xml")
+
+    if not os.path.isfile(shard_path):
+        abort(404)
+
+    return send_file(shard_path, mimetype="application/xml", max_age=3600)
@@ -0,0 +1,311 @@
+import hashlib, os, tempfile, time
+
+import click
+from flask import Request, current_app
+from flask.cli import with_appcontext
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+import psycopg2.extras
+
+from .db import get_conn, get_cur
+from .images import get_variant_dir
+
+CHUNK_SIZE = 64 * 1024
+
+
+def get_blob_dir():
+    return os.path.join(current_app.instance_path, "blobs")
+
+
+def get_blob_path(digest):
+    return os.path.join(get_blob_dir(), digest[:2], digest[2:4], digest)
+
+
+def get_max_file_size():
+    return current_app.config.get("UPLOADS", {}).get(
+        "MAX_FILE_SIZE", 16 * 1024 * 1024
+    )
+
+
+class HashingFile:
+    """Temporary upload file that hashes and size-checks every write."""
+
+    def __init__(self, directory, limit=None):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=directory, suffix=".part")
+        self._fh = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.limit = limit
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            # The form parser drops the half-written file on error, so it
+            # would never be closed (and removed) otherwise.
+            self.close()
+            raise RequestEntityTooLarge()
+
+        self._hash.update(data)
+        return self._fh.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._fh.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._fh, name)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None,
+        content_length=None,
+    ):
+        return HashingFile(
+            os.path.join(get_blob_dir(), "tmp"), get_max_file_size()
+        )
+
+
+def store_upload(file_obj):
+    """Move an uploaded file into the content-addressed blob store.
+
+    Returns ``(digest, size, path)``. Identical content is stored once;
+    the ``files`` triggers keep ``blobs.ref_count`` up to date.
+    """
+    stream = file_obj.stream
+    if not isinstance(stream, HashingFile):
+        hashing_file = HashingFile(
+            os.path.join(get_blob_dir(), "tmp"), get_max_file_size()
+        )
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hashing_file.write(chunk)
+        stream = hashing_file
+
+    stream.flush()
+    digest = stream.hexdigest()
+    blob_path = get_blob_path(digest)
+
+    if os.path.exists(blob_path):
+        # A fresh mtime keeps storage-gc away while the row is inserted.
+        os.utime(blob_path)
+    else:
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # mkstemp creates 0600 files; a front proxy serving offloaded
+        # files may run as another user and needs to read them.
+        os.chmod(
+            stream.name,
+            current_app.config.get("UPLOADS", {}).get("FILE_MODE", 0o644),
+        )
+        os.replace(stream.name, blob_path)
+
+    return digest, stream.size, blob_path
+
+
+def save_attachments(cur, post_id, file_objs):
+    """Store uploads and attach them to a post in one statement.
+
+    Uploading a name the post already has swaps the content in place, so
+    the file id, and every link to it, stays the same; the old content's
+    image variants are dropped. Returns the ids of new or changed files.
+    """
+    rows = dict()
+    for file_obj in file_objs:
+        digest, size, blob_path = store_upload(file_obj)
+        file_name = secure_filename(file_obj.filename)
+        rows[file_name] = (post_id, file_name, blob_path, digest, size)
+
+    if not rows:
+        return list()
+
+    file_ids = [
+        row[0]
+        for row in psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO files "
+            "(post_id, file_name, file_path, blob_hash, size) VALUES %s "
+            "ON CONFLICT (post_id, file_name) DO UPDATE SET "
+            "file_path = EXCLUDED.file_path, "
+            "blob_hash = EXCLUDED.blob_hash, size = EXCLUDED.size "
+            "WHERE files.blob_hash IS DISTINCT FROM EXCLUDED.blob_hash "
+            "RETURNING id;",
+            list(rows.values()),
+            fetch=True,
+        )
+    ]
+    if file_ids:
+        cur.execute(
+            "DELETE FROM file_variants WHERE file_id = ANY(%s);", (file_ids,)
+        )
+
+    return file_ids
+
+
+def iter_files(root):
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in sorted(file_names):
+            yield os.path.join(dir_path, file_name)
+
+
+def iter_batches(items, batch_size):
+    batch = list()
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+
+def remove_file(path, dry_run):
+    try:
+        size = os.path.getsize(path)
+        if not dry_run:
+            os.remove(path)
+    except FileNotFoundError:
+        return None
+
+    return size
+
+
+def remove_empty_dirs(root):
+    for dir_path, _, _ in os.walk(root, topdown=False):
+        if dir_path != root and not os.listdir(dir_path):
+            try:
+                os.rmdir(dir_path)
+            except OSError:
+                pass
+
+
+def is_stale(path, cutoff):
+    try:
+        return os.path.getmtime(path) < cutoff
+    except FileNotFoundError:
+        return False
+
+
+def collect_garbage(batch_size=500, dry_run=False):
+    """Delete upload files that no ``files`` or ``file_variants`` row uses.
+
+    Blobs and variants younger than UPLOADS.GC_GRACE seconds are kept, as
+    they may belong to a request that has not committed yet. Returns
+    ``{kind: [file count, bytes]}``.
+    """
+    conn = get_conn()
+    cur = get_cur()
+    instance_path = current_app.instance_path
+    blob_dir = get_blob_dir()
+    variant_dir = get_variant_dir()
+    grace = current_app.config.get("UPLOADS", {}).get("GC_GRACE", 3600)
+    cutoff = time.time() - grace
+    stats = {"legacy": [0, 0], "blobs": [0, 0], "variants": [0, 0]}
+
+    def reclaim(kind, path):
+        size = remove_file(path, dry_run)
+        if size is not None:
+            stats[kind][0] += 1
+            stats[kind][1] += size
+
+    # Pre-blob uploads live in instance/<post_id>/<name>.
+    post_ids = sorted(
+        int(name)
+        for name in os.listdir(instance_path)
+        if name.isdigit() and os.path.isdir(os.path.join(instance_path, name))
+    )
+    for batch in iter_batches(post_ids, batch_size):
+        cur.execute(
+            "SELECT file_path FROM files WHERE post_id = ANY(%s);", (batch,)
+        )
+        live = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        for post_id in batch:
+            for path in iter_files(os.path.join(instance_path, str(post_id))):
+                if path not in live:
+                    reclaim("legacy", path)
+
+    for batch in iter_batches(iter_files(blob_dir), batch_size):
+        digests = [os.path.basename(path) for path in batch]
+        cur.execute(
+            "SELECT hash FROM blobs WHERE hash = ANY(%s) AND ref_count > 0;",
+            (digests,),
+        )
+        live = {row[0] for row in cur.fetchall()}
+        dead = {
+            os.path.basename(path): path
+            for path in batch
+            if os.path.basename(path) not in live and is_stale(path, cutoff)
+        }
+
+        if dead and not dry_run:
+            # ref_count is checked again under the row lock; an upload that
+            # reused a blob in the meantime also refreshed its mtime.
+            cur.execute(
+                "DELETE FROM blobs WHERE hash = ANY(%s) AND ref_count = 0;",
+                (list(dead),),
+            )
+        conn.commit()
+
+        for path in dead.values():
+            if is_stale(path, cutoff):
+                reclaim("blobs", path)
+
+    for batch in iter_batches(iter_files(variant_dir), batch_size):
+        cur.execute(
+            "SELECT file_path FROM file_variants WHERE file_path = ANY(%s);",
+            (batch,),
+        )
+        live = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        for path in batch:
+            if path not in live and is_stale(path, cutoff):
+                reclaim("variants", path)
+
+    if not dry_run:
+        for post_id in post_ids:
+            remove_empty_dirs(os.path.join(instance_path, str(post_id)))
+            try:
+                os.rmdir(os.path.join(instance_path, str(post_id)))
+            except OSError:
+                pass
+        remove_empty_dirs(blob_dir)
+        remove_empty_dirs(variant_dir)
+
+    return stats
+
+
+@click.command("storage-gc")
+@click.option("--dry-run", is_flag=True, help="Only report what would go.")
+@click.option("--batch-size", default=500, show_default=True)
+@with_appcontext
+def storage_gc_command(dry_run, batch_size):
+    """Delete uploaded files that are no longer referenced."""
+    stats = collect_garbage(batch_size, dry_run)
+    for kind, (count, size) in stats.items():
+        click.echo(f"{kind}: {count} files, {size} bytes")
+
+    total = sum(size for _, size in stats.values())
+    if dry_run:
+        click.echo(f"Would reclaim {total} bytes.")
+    else:
+        click.echo(f"Reclaimed {total} bytes.")
+
+
+def init_app(app):
+    app.cli.add_command(storage_gc_command)
+    app.request_class = UploadRequest
+    if app.config.get("MAX_CONTENT_LENGTH") is None:
+        app.config["MAX_CONTENT_LENGTH"] = app.config.get("UPLOADS", {}).get(
+            "MAX_REQUEST_SIZE", 64 * 1024 * 1024
+        )